@@ -1,51 +1,202 @@
 # app/_gemini_connector.py
 
 import os
+import json
+import time
+import threading
 from dotenv import load_dotenv
-import google.generativeai as genai
+from app.metrics import span, annotate
+from app.sql_cache import schema_fingerprint
+from app.inspect_db import inspect_schema, describe_schema
 
-# Load .env and configure Gemini API key
+# Load .env; the Gemini SDK itself is only imported and configured on first use
 load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
-if not API_KEY:
-    raise EnvironmentError("❌ Gemini API key not found in environment variables!")
+# Lite for speed; switch to pro if needed
+MODEL_NAME = os.getenv("GEMINI_MODEL", "models/gemini-2.5-flash-lite")
 
-genai.configure(api_key=API_KEY)
+# Created by get_model(); assign a stand-in (e.g. FakeModel) here to bypass the SDK
+model = None
+_model_lock = threading.Lock()
+_warm = threading.Event()
 
-# Define the model (Lite for speed; switch to pro if needed)
-model = genai.GenerativeModel(model_name="models/gemini-2.5-flash-lite")
+DB_PATH = os.getenv("ECOMMERCE_DB_PATH", "database/ecommerce.db")
 
-def ask_gemini(question: str) -> str:
+# Used when the database can't be introspected (e.g. before the first load)
+FALLBACK_SCHEMA = """- eligibility: eligibility_datetime_utc, item_id, eligibility, message
+- ad_sales_metrics: date, item_id, ad_sales, impressions, ad_spend, clicks, units_sold
+- total_sales_metrics: date, item_id, total_sales, total_units_ordered
+- daily_sales_rollup: date, total_sales, total_units_ordered, ad_sales, ad_spend, clicks, impressions, units_sold, ctr, cpc, roas
+- item_sales_rollup: item_id, total_sales, total_units_ordered, ad_sales, ad_spend, clicks, impressions, units_sold, ctr, cpc, roas"""
+
+DATE_RULE = ("Date columns hold INTEGER days since 1970-01-01 (shown above as dates): "
+             "filter with integers, e.g. date >= CAST(julianday('2025-06-01') - 2440587.5 AS INTEGER), "
+             "and select date(date * 86400, 'unixepoch') AS date.")
+ROLLUP_RULE = "Prefer daily_sales_rollup / item_sales_rollup for totals or CTR, CPC and ROAS by date or by item."
+
+_prefixes = {}
+
+
+def schema_prompt(db_path: str = DB_PATH) -> str:
     """
-    Converts an English question into a valid SQLite SQL query using Gemini.
-    Returns plain SQL as a string.
+    Prompt prefix describing the live schema (types, row counts, value ranges).
+    It is built once per schema fingerprint and reused verbatim, so every prompt
+    for the same data version starts with an identical prefix.
     """
-    prompt = f"""
-You are a helpful assistant that converts English questions to SQLite SQL queries.
-Only return the SQL query — no explanations, no code formatting like ```sql.
-The database has the following tables and columns:
+    fingerprint = schema_fingerprint(db_path)
+    cached = _prefixes.get(db_path)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
 
-- eligibility(eligibility_datetime_utc, item_id, eligibility, message)
-- ad_sales_metrics(date, item_id, ad_sales, impressions, ad_spend, clicks, units_sold)
-- total_sales_metrics(date, item_id, total_sales, total_units_ordered)
+    try:
+        tables = inspect_schema(db_path)
+        schema = describe_schema(tables)
+        names = {t["name"] for t in tables}
+        has_dates = any(c.get("is_date") for t in tables for c in t["columns"])
+    except Exception as e:
+        print(f"ℹ Schema introspection failed, using the built-in description: {e}")
+        schema, names, has_dates = FALLBACK_SCHEMA, {"daily_sales_rollup"}, True
+
+    rules = [DATE_RULE] if has_dates else []
+    if {"daily_sales_rollup", "item_sales_rollup"} & names:
+        rules.append(ROLLUP_RULE)
+    rules.append("Join tables on item_id.")
+
+    prefix = ("You convert English questions about e-commerce data into SQLite SQL.\n"
+              "Tables (columns with type, and value range where useful):\n" + schema + "\n" + "\n".join(rules))
+    _prefixes[db_path] = (fingerprint, prefix)
+    print(f"✅ Built schema prompt for {db_path} ({len(prefix)} chars)")
+    return prefix
 
-Join tables using item_id when necessary.
-Avoid using any markdown formatting.
-Return only valid, executable SQL.
 
+def build_prompt(question: str, db_path: str = DB_PATH, failures: list = ()) -> str:
+    """
+    Prompt for one question. failures are (sql, error) pairs that already failed for it;
+    they are listed with their SQLite errors so the model corrects them instead of repeating them.
+    """
+    repair = ""
+    if failures:
+        repair = "\nThese queries failed for this question; fix the error and don't repeat them:\n" + "\n".join(
+            f"Failed query: {' '.join(sql.split())}\nSQLite error: {error}" for sql, error in failures) + "\n"
+    return f"""{schema_prompt(db_path)}
+Return one executable SELECT statement only — no explanations, no markdown.
+{repair}
 Question: {question}
 SQL:"""
 
+
+def build_batch_prompt(questions: list, db_path: str = DB_PATH) -> str:
+    numbered = json.dumps({str(i + 1): q for i, q in enumerate(questions)}, ensure_ascii=False)
+    return f"""{schema_prompt(db_path)}
+Answer every question with one executable SELECT statement. Return only a JSON object that
+maps each question number to its SQL string — no explanations, no markdown.
+
+Questions (JSON): {numbered}
+Answers (JSON):"""
+
+
+def get_model():
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                if not API_KEY:
+                    raise EnvironmentError("❌ Gemini API key not found in environment variables!")
+                import google.generativeai as genai
+                genai.configure(api_key=API_KEY)
+                model = genai.GenerativeModel(model_name=MODEL_NAME)
+    return model
+
+
+def warm_up(db_path: str = DB_PATH):
+    """
+    Startup hook: loads the Gemini SDK and builds the schema prompt ahead of the
+    first question. Safe to call from a background thread while requests are served.
+    """
+    start = time.perf_counter()
     try:
-        response = model.generate_content(prompt)
-        sql = response.text.strip()
+        get_model()
+        schema_prompt(db_path)
+    except Exception as e:
+        print(f"❌ Warm-up failed: {e}")
+        return
+    _warm.set()
+    print(f"✅ Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+
+def is_warm() -> bool:
+    return _warm.is_set()
 
-        # Basic sanitization
-        if not sql.lower().startswith("select"):
-            raise ValueError("Gemini response did not contain a valid SQL SELECT statement.")
 
-        return sql
+def extract_sql(response) -> str:
+    sql = response.text.strip()
 
+    # Basic sanitization
+    if not sql.lower().startswith("select"):
+        raise ValueError("Gemini response did not contain a valid SQL SELECT statement.")
+
+    return sql
+
+
+def ask_gemini(question: str, db_path: str = DB_PATH, failures: list = ()) -> str:
+    """
+    Converts an English question into a valid SQLite SQL query using Gemini.
+    Pass the (sql, error) pairs that already failed to ask for a repair.
+    Returns plain SQL as a string. Model errors are raised, and ValueError is raised
+    when the answer isn't a SELECT statement.
+    """
+    with span("prompt_build"):
+        prompt = build_prompt(question, db_path, failures)
+    annotate(prompt_chars=len(prompt))
+
+    with span("gemini_repair_call" if failures else "gemini_call"):
+        response = get_model().generate_content(prompt)
+    return extract_sql(response)
+
+
+def parse_batch_answer(text: str, count: int) -> dict:
+    """
+    Returns {index: sql} for the usable entries of a batch answer; anything that is
+    missing or not a SELECT is left out so the caller can ask for it separately.
+    """
+    text = text.strip()
+    if "```" in text:
+        text = text.split("```")[1].removeprefix("json").strip()
+    try:
+        answers = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(answers, dict):
+        return {}
+
+    parsed = {}
+    for key, sql in answers.items():
+        if str(key).isdigit() and 1 <= int(key) <= count and isinstance(sql, str) \
+                and sql.strip().lower().startswith("select"):
+            parsed[int(key) - 1] = sql.strip()
+    return parsed
+
+
+def ask_gemini_batch(questions: list, db_path: str = DB_PATH) -> list:
+    """
+    Converts several questions with one Gemini call and returns their SQL in order.
+    Questions the batch answer doesn't cover come back as None, so the caller can ask
+    for them one by one.
+    """
+    if not questions:
+        return []
+
+    with span("prompt_build"):
+        prompt = build_batch_prompt(questions, db_path)
+    annotate(prompt_chars=len(prompt))
+
+    try:
+        with span("gemini_batch_call"):
+            response = get_model().generate_content(prompt)
+        answers = parse_batch_answer(response.text, len(questions))
     except Exception as e:
-        return f"SELECT 'Error: {str(e)}' AS error_message;"
+        print(f"ℹ Batch prompt failed, asking questions separately: {e}")
+        answers = {}
+
+    return [answers.get(i) for i in range(len(questions))]
@@ -3,39 +3,192 @@ import streamlit as st
 st.set_page_config(page_title="E-commerce AI Agent", layout="wide")
 
 # --- Imports ---
+# pandas, plotly and streamlit_lottie are imported where they are used, so the login
+# page and the first render don't pay for them
 import requests
-import pandas as pd
-import plotly.express as px
 from streamlit_option_menu import option_menu
-from streamlit_lottie import st_lottie
-# Assuming user_store.py and users.json are correctly set up for authentication
-from user_store import add_user, validate_user
+# Users live in the SQLite store behind user_store.py (users.json is migrated on first import)
+from user_store import add_user, validate_user, create_session, session_user
 import os
+import json
 
 # --- Inject CSS ---
+@st.cache_data(show_spinner=False)
+def read_css(file_path):
+    # Read once per server process; the stylesheet is re-injected on every rerun from memory
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path) as f:
+        return f.read()
+
 def local_css(file_path):
-    if os.path.exists(file_path):
-        with open(file_path) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    css = read_css(file_path)
+    if css is not None:
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
     else:
         st.warning(f"⚠ CSS file not found: {file_path}")
 
 local_css("style.css")
 
 # --- Load Lottie Animation ---
+LOTTIE_URL = "https://lottie.host/1a9342fa-35e1-4720-b66c-2ef8c6805ae0/2X4XZnDGBg.json"
+
+@st.cache_resource(show_spinner=False)
 def load_lottieurl(url: str):
-    r = requests.get(url)
+    # Fetched once and shared by every session instead of on each rerun
+    try:
+        r = requests.get(url, timeout=5)
+    except requests.exceptions.RequestException:
+        return None
     if r.status_code != 200:
         return None
     return r.json()
 
 def show_lottie():
-    lottie = load_lottieurl("https://lottie.host/1a9342fa-35e1-4720-b66c-2ef8c6805ae0/2X4XZnDGBg.json")
+    from streamlit_lottie import st_lottie
+    lottie = load_lottieurl(LOTTIE_URL)
     if lottie:
         st_lottie(lottie, height=200)
 
 # --- Backend API ---
 BACKEND_URL = "http://127.0.0.1:5000/ask"
+CHART_URL = BACKEND_URL + "/chart"
+MAX_UI_ROWS = 5000  # rows requested per answer; the backend pages anything beyond this
+CHUNK_ROWS = 1000   # rows turned into a DataFrame at a time while streaming
+CHART_POINTS = 500  # point budget per chart; longer series are bucketed and downsampled
+
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+MSGPACK_MIME = "application/x-msgpack"
+
+def binary_format():
+    # Arrow IPC when pyarrow is installed, then MessagePack, otherwise the NDJSON stream
+    for mime, module in ((ARROW_MIME, "pyarrow"), (MSGPACK_MIME, "msgpack")):
+        try:
+            __import__(module)
+            return mime
+        except ImportError:
+            continue
+    return None
+
+def fetch_answer(question: str, filters: dict = None) -> dict:
+    """
+    Fetches the answer as Arrow IPC or MessagePack when available (see read_binary_answer),
+    otherwise as an NDJSON stream (see read_ndjson_answer). The request always asks for the
+    stream, so a backend that can't encode the binary format streams NDJSON in the same
+    response instead of sending the whole result as JSON first.
+    filters ({"item_id": ..., "message": ...}) are applied by the backend in SQL.
+    """
+    mime = binary_format()
+    headers = {"Accept": f"{mime}, application/x-ndjson;q=0.5"} if mime else {}
+    with requests.post(BACKEND_URL, json={"question": question, "stream": True, "limit": MAX_UI_ROWS,
+                                             "filters": filters or {}},
+                       headers=headers, stream=True) as res:
+        content_type = res.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            # Errors of the binary formats come back as JSON
+            body = res.json()
+            raise RuntimeError(body.get("error") or f"Unexpected response: {body}")
+        res.raise_for_status()
+        if content_type.startswith("application/x-ndjson"):
+            return read_ndjson_answer(res)
+        return read_binary_answer(res.content, content_type.split(";")[0])
+
+def read_ndjson_answer(res) -> dict:
+    """
+    Builds the DataFrame chunk by chunk while the NDJSON stream arrives,
+    so the raw JSON for the whole result is never held in memory at once.
+    """
+    import pandas as pd
+    header, trailer, chunks, rows = {}, {}, [], []
+    for line in res.iter_lines():
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, list):
+            rows.append(record)
+            if len(rows) >= CHUNK_ROWS:
+                chunks.append(pd.DataFrame(rows, columns=header.get("columns") or None))
+                rows = []
+        elif "error" in record:
+            raise RuntimeError(record["error"])
+        elif "columns" in record:
+            header = record
+        else:
+            trailer = record
+    if rows:
+        chunks.append(pd.DataFrame(rows, columns=header.get("columns") or None))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    return {"sql_query": header.get("sql_query", ""), "df": df, "truncated": trailer.get("truncated", False),
+            "filters": header.get("filters", {}), "answer_token": header.get("answer_token")}
+
+def read_binary_answer(content: bytes, mime: str) -> dict:
+    """
+    One page of MAX_UI_ROWS rows encoded by column. Arrow buffers are turned into the
+    DataFrame without going through Python objects; MessagePack columns keep their dtypes.
+    """
+    import pandas as pd
+    if mime == ARROW_MIME:
+        import pyarrow as pa
+        table = pa.ipc.open_stream(content).read_all()
+        meta = json.loads(table.schema.metadata[b"ask"])
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+    else:
+        import msgpack
+        meta = msgpack.unpackb(content, raw=False)
+        dtypes = {"int64": "Int64", "float64": "float64", "string": "string"}
+        df = pd.DataFrame({i: pd.Series(values, dtype=dtypes.get(dtype, "object"))
+                           for i, (values, dtype) in enumerate(zip(meta["data"], meta["dtypes"]))})
+        df.columns = meta["columns"]
+    return {"sql_query": meta.get("sql_query", ""), "df": df, "truncated": meta.get("truncated", False),
+            "filters": meta.get("filters", {}), "answer_token": meta.get("answer_token")}
+
+def fetch_chart(question: str, x: str, y: str, filters: dict = None, answer_token: str = None) -> dict:
+    """
+    Asks the backend for the chart series: the whole result bucketed by day/week/month
+    and downsampled to CHART_POINTS, instead of plotting every row. answer_token makes
+    the backend chart the same SQL as the table on screen.
+    """
+    res = requests.post(CHART_URL, json={"question": question, "x": x, "y": y, "points": CHART_POINTS,
+                                           "filters": filters or {}, "answer_token": answer_token})
+    body = res.json()
+    if "error" in body:
+        raise RuntimeError(body["error"])
+    return body
+
+# --- Session Answer Cache ---
+# The last ANSWER_HISTORY answers of this session, keyed by (question, filters), so reruns
+# caused by widget changes (chart type, axes) redraw from memory instead of calling the backend
+ANSWER_HISTORY = int(os.getenv("UI_ANSWER_HISTORY", "5"))
+
+def session_answers() -> dict:
+    # Kept per logged-in user, so signing in as someone else in the same tab starts empty
+    return st.session_state.setdefault("answers", {}).setdefault(st.session_state.get("username"), {})
+
+def answer_key(question: str, filters: dict) -> tuple:
+    return (question.strip(), tuple(sorted((k, str(v).strip()) for k, v in filters.items() if str(v).strip())))
+
+def cached_answer(question: str, filters: dict) -> dict:
+    answers = session_answers()
+    key = answer_key(question, filters)
+    if key in answers:
+        answers[key] = answers.pop(key)  # most recently used goes last
+        return answers[key]
+
+    data = fetch_answer(question, filters)
+    if "item_id" in data["df"].columns:
+        # Missing ids are NaN in NDJSON / Arrow frames and pd.NA in MessagePack's Int64 columns
+        data["df"]["item_id"] = data["df"]["item_id"].astype(object).where(data["df"]["item_id"].notna(), "").astype(str)
+    data.update(question=question, filters_sent=filters, charts={})
+    answers[key] = data
+    while len(answers) > ANSWER_HISTORY:
+        answers.pop(next(iter(answers)))
+    return data
+
+def cached_chart(data: dict, x: str, y: str) -> dict:
+    # Series are cached on the answer itself, so switching chart type never refetches
+    if (x, y) not in data["charts"]:
+        data["charts"][(x, y)] = fetch_chart(data["question"], x, y, data["filters_sent"], data.get("answer_token"))
+    return data["charts"][(x, y)]
 
 # --- Signup ---
 def signup():
@@ -55,6 +208,7 @@ def login():
     password = st.text_input("Password", type="password", key="login_password")
     if st.button("Login", key="login_button"):
         if validate_user(username, password):
+            st.session_state["session_token"] = create_session(username)
             st.session_state["authenticated"] = True
             st.session_state["username"] = username
             st.rerun()
@@ -124,102 +278,109 @@ def main_app():
 
         with st.spinner("Thinking..."):
             try:
-                res = requests.post(BACKEND_URL, json={"question": query})
-                res.raise_for_status()
-                data = res.json()
-
-                sql = data.get("sql_query", "")
-                results = data.get("results", [])
-
-                if sql:
-                    st.markdown("### 🧮 Generated SQL")
-                    st.code(sql, language="sql")
-
-                if results:
-                    df = pd.DataFrame(results)
-
-                    if "item_id" in df.columns:
-                        df["item_id"] = df["item_id"].astype(str).replace('nan', '')
-                    if "message" in df.columns:
-                        df["message"] = df["message"].astype(str).replace('nan', '')
-
-                    filtered_df = df.copy()
-                    try:
-                        if item_id_filter and "item_id" in filtered_df.columns:
-                            st.write("🛠 Applying Item ID filter...")
-                            filtered_df = filtered_df[filtered_df["item_id"].str.contains(item_id_filter.lower(), case=False, na=False)]
-                    except Exception as e:
-                        st.error(f"❌ Error applying Item ID filter: {e}")
-
-                    try:
-                        if eligibility_filter and "message" in filtered_df.columns:
-                            st.write("🛠 Applying Eligibility Message filter...")
-                            filtered_df = filtered_df[filtered_df["message"].str.contains(eligibility_filter.lower(), case=False, na=False)]
-                    except Exception as e:
-                        st.error(f"❌ Error applying Message filter: {e}")
-
-                    st.markdown("### 📋 Results Table")
-                    if not filtered_df.empty:
-                        st.dataframe(filtered_df, use_container_width=True)
-                    else:
-                        st.info("No results found after applying filters.")
-
-                    df_for_charting = filtered_df.copy()
-
-                    # --- FIXED CODE ---
-                    time_cols = [
-                        col for col in df_for_charting.columns
-                        if isinstance(col, str) and ('date' in col.lower() or 'time' in col.lower())
-                    ]
-                    # ------------------
-
-                    numeric_cols = df_for_charting.select_dtypes(include='number').columns.tolist()
-
-                    if time_cols and numeric_cols and not df_for_charting.empty:
-                        st.markdown("### 📈 Auto Chart")
-                        default_x = time_cols[0] if time_cols else None
-                        default_y = numeric_cols[0] if numeric_cols else None
-
-                        x_axis_index = time_cols.index(default_x) if default_x in time_cols else 0
-                        y_axis_index = numeric_cols.index(default_y) if default_y in numeric_cols else 0
-
-                        x_axis = st.selectbox("🗂 Select X-axis", time_cols, index=x_axis_index)
-                        y_axis = st.selectbox("📐 Select Y-axis", numeric_cols, index=y_axis_index)
-
-                        df_for_charting[x_axis] = pd.to_datetime(df_for_charting[x_axis], errors='coerce')
-                        df_chart_final = df_for_charting.dropna(subset=[x_axis])
-
-                        if not df_chart_final.empty:
-                            df_chart_final = df_chart_final.sort_values(by=x_axis)
-
-                            if chart_type == "Line":
-                                fig = px.line(df_chart_final, x=x_axis, y=y_axis, title=f"{y_axis} over {x_axis}")
-                            elif chart_type == "Bar":
-                                fig = px.bar(df_chart_final, x=x_axis, y=y_axis, title=f"{y_axis} by {x_axis}")
-                            elif chart_type == "Area":
-                                fig = px.area(df_chart_final, x=x_axis, y=y_axis, title=f"{y_axis} Area Chart over {x_axis}")
-
-                            st.plotly_chart(fig, use_container_width=True)
-                        else:
-                            st.info("ℹ No valid data points for charting after date conversion or filtering.")
-                    else:
-                        st.info("ℹ Not enough valid time and numeric columns or data to plot a chart.")
-                else:
-                    st.warning("No results found for your query.")
+                filters = {"item_id": item_id_filter, "message": eligibility_filter}
+                st.session_state["current_answer"] = answer_key(query, filters)
+                cached_answer(query, filters)
             except requests.exceptions.ConnectionError:
                 st.error("❌ Connection Error: Could not connect to the backend API. Please ensure it's running.")
+                return
             except requests.exceptions.RequestException as e:
                 st.error(f"❌ API Request Error: {e}")
-            except Exception as e:
-                st.error(f"❌ An unexpected error occurred: {e}")
-                import traceback
-                st.exception(e)
-                traceback.print_exc()
+                return
+            except RuntimeError as e:
+                st.error(f"❌ Query Error: {e}")
+                return
+
+    # The answer stays on screen across reruns; only "Ask" with a new question or new filters calls the backend
+    data = session_answers().get(st.session_state.get("current_answer"))
+    if data is None:
+        return
+
+    try:
+        show_answer(data, chart_type)
+    except requests.exceptions.ConnectionError:
+        st.error("❌ Connection Error: Could not connect to the backend API. Please ensure it's running.")
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ API Request Error: {e}")
+    except RuntimeError as e:
+        st.error(f"❌ Query Error: {e}")
+    except Exception as e:
+        st.error(f"❌ An unexpected error occurred: {e}")
+        import traceback
+        st.exception(e)
+        traceback.print_exc()
+
+def show_answer(data: dict, chart_type: str):
+    sql = data.get("sql_query", "")
+    df = data["df"]
+
+    if sql:
+        st.markdown("### 🧮 Generated SQL")
+        st.code(sql, language="sql")
+
+    if data["truncated"]:
+        st.info(f"ℹ Showing the first {MAX_UI_ROWS} rows of a larger result.")
+
+    if df.empty:
+        st.warning("No results found for your query.")
+        return
+
+    if data["filters"]:
+        st.write("🛠 Filtered by " + ", ".join(f"{k} = {v}" for k, v in data["filters"].items()))
+
+    st.markdown("### 📋 Results Table")
+    st.dataframe(df, use_container_width=True)
+
+    time_cols = [
+        col for col in df.columns
+        if isinstance(col, str) and ('date' in col.lower() or 'time' in col.lower())
+    ]
+    numeric_cols = [
+        col for col in df.select_dtypes(include='number').columns.tolist()
+        if col not in time_cols
+    ]
+
+    if not (time_cols and numeric_cols):
+        st.info("ℹ Not enough valid time and numeric columns or data to plot a chart.")
+        return
+
+    import pandas as pd
+    import plotly.express as px
+    st.markdown("### 📈 Auto Chart")
+
+    x_axis = st.selectbox("🗂 Select X-axis", time_cols, index=0)
+    y_axis = st.selectbox("📐 Select Y-axis", numeric_cols, index=0)
+
+    # Charted by the backend over the full (filtered) result, not just the rows on screen
+    series = cached_chart(data, x_axis, y_axis)
+
+    if not series["points"]:
+        st.info("ℹ No valid data points for charting after date conversion or filtering.")
+        return
+
+    df_chart_final = pd.DataFrame(series["points"], columns=[x_axis, y_axis])
+    df_chart_final[x_axis] = pd.to_datetime(df_chart_final[x_axis])
+    label = f"{y_axis} ({series['agg']} per {series['bucket']})"
+
+    if chart_type == "Line":
+        fig = px.line(df_chart_final, x=x_axis, y=y_axis, title=f"{label} over {x_axis}")
+    elif chart_type == "Bar":
+        fig = px.bar(df_chart_final, x=x_axis, y=y_axis, title=f"{label} by {x_axis}")
+    elif chart_type == "Area":
+        fig = px.area(df_chart_final, x=x_axis, y=y_axis, title=f"{label} Area Chart over {x_axis}")
+
+    st.plotly_chart(fig, use_container_width=True)
+    if series.get("downsampled"):
+        st.caption(f"ℹ {series['source_rows']} rows downsampled to {len(series['points'])} points.")
 
 # --- Routing ---
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
 
+# Reruns are authorised by the in-process session token, without hashing the password again
+if st.session_state["authenticated"] and session_user(st.session_state.get("session_token")) is None:
+    st.session_state["authenticated"] = False
+
 with st.sidebar:
     page = option_menu("Navigation", ["Login", "Sign Up"],
                        icons=['box-arrow-in-right', 'person-plus'], default_index=0, key="auth_navigation")
@@ -0,0 +1,199 @@
+# app/asgi.py
+
+import os
+import asyncio
+import traceback
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from app.async_gemini import ask_gemini_async, get_client
+from app._gemini_connector import warm_up, is_warm
+from app.query_engine import clean_sql, execute_sql, remember_sql, apply_filters
+from app.sql_cache import get_cached_sql
+from app.intents import match_intent
+from app.sql_repair import (REPAIR_MAX_ATTEMPTS, validate_sql, past_failures, record_failure, forget_failures,
+                            record_outcome)
+from app.db_pool import health_check, pool_stats, close_all_pools
+from app.encoding import JSON_MIME, negotiate, encode_result, compress
+from app.metrics import trace, span, annotate, register_gauges, pipeline_gauges, render_prometheus
+
+# ASGI version of the /ask endpoint: model calls run on the event loop,
+# SQLite work runs in a bounded thread pool.
+DB_PATH = os.getenv("ECOMMERCE_DB_PATH", "database/ecommerce.db")
+SQL_WORKERS = int(os.getenv("SQL_WORKERS", "8"))
+
+# Requests beyond this many in flight get 429 instead of queueing forever
+MAX_PENDING = int(os.getenv("MAX_PENDING_REQUESTS", "64"))
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "30"))
+
+_state = {"pending": 0, "accepting": True, "rejected": 0, "executor": None}
+
+
+async def run_in_db_thread(func, *args):
+    loop = asyncio.get_running_loop()
+    # Carry the request trace into the worker thread so its spans are attributed to it
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_state["executor"], context.run, func, *args)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _state["executor"] = ThreadPoolExecutor(max_workers=SQL_WORKERS, thread_name_prefix="sqlite")
+    _state["accepting"] = True
+    # Load the Gemini SDK and introspect the schema off the event loop without delaying startup
+    if os.getenv("WARM_UP_ON_START", "1") == "1":
+        asyncio.get_running_loop().run_in_executor(_state["executor"], warm_up, DB_PATH)
+    yield
+
+    # Graceful shutdown: refuse new work, let in-flight requests finish, then release resources
+    _state["accepting"] = False
+    deadline = asyncio.get_running_loop().time() + SHUTDOWN_GRACE_SECONDS
+    while _state["pending"] and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.1)
+    _state["executor"].shutdown(wait=True)
+    close_all_pools()
+
+
+app = FastAPI(title="E-commerce AI Agent", lifespan=lifespan)
+register_gauges(pipeline_gauges)
+
+
+async def generate_valid_sql(question: str) -> str:
+    """
+    Async version of query_engine.generate_valid_sql: model calls stay on the event loop,
+    EXPLAIN validation runs on the SQLite thread pool, and failing SQL is sent back with
+    its error for at most REPAIR_MAX_ATTEMPTS repairs.
+    """
+    failures = await run_in_db_thread(past_failures, question, DB_PATH)
+    error = None
+    for attempt in range(REPAIR_MAX_ATTEMPTS + 1):
+        try:
+            sql_query = clean_sql(await ask_gemini_async(question, DB_PATH, failures))
+        except ValueError as e:
+            error = str(e)
+            continue
+
+        error = await run_in_db_thread(validate_sql, sql_query, DB_PATH)
+        if error is None:
+            record_outcome(attempt, True)
+            await run_in_db_thread(forget_failures, question, DB_PATH)
+            return sql_query
+        failures = await run_in_db_thread(record_failure, question, sql_query, error, DB_PATH)
+
+    record_outcome(REPAIR_MAX_ATTEMPTS, False)
+    raise ValueError(f"No valid SQL after {REPAIR_MAX_ATTEMPTS} repairs: {error}")
+
+
+async def answer(question: str, filters: dict = None) -> dict:
+    # Step 1: Template match, then cached SQL, otherwise ask Gemini without blocking the event loop
+    params, from_model = (), False
+    matched = await run_in_db_thread(match_intent, question, DB_PATH)
+    if matched is not None:
+        sql_query, params, _ = matched
+    else:
+        sql_query = await run_in_db_thread(get_cached_sql, question, DB_PATH)
+        if sql_query is None:
+            sql_query = await generate_valid_sql(question)
+            from_model = True
+
+    # Step 2: Filters are applied in SQL around the answer, as in query_engine.run_query
+    filtered_sql, params, applied = await run_in_db_thread(apply_filters, sql_query, filters, DB_PATH, params)
+
+    # Step 3: Execute on the bounded SQLite thread pool
+    columns, results = await run_in_db_thread(execute_sql, filtered_sql, DB_PATH, params)
+    if from_model:
+        await run_in_db_thread(remember_sql, question, sql_query, DB_PATH)
+
+    return {"question": question, "sql_query": sql_query, "filters": applied, "columns": columns,
+            "results": results}
+
+
+@app.post("/ask")
+async def ask_question(request: Request):
+    if not _state["accepting"]:
+        return JSONResponse({"error": "Server is shutting down"}, status_code=503)
+    if _state["pending"] >= MAX_PENDING:
+        _state["rejected"] += 1
+        return JSONResponse({"error": "Too many requests in flight, retry shortly"},
+                            status_code=429, headers={"Retry-After": "1"})
+
+    _state["pending"] += 1
+    try:
+        data = await request.json()
+        question = data.get("question")
+
+        if not question:
+            return JSONResponse({"error": "No question provided"}, status_code=400)
+
+        # Optional {"item_id": "29", "message": "cost"}, applied in SQL
+        filters = data.get("filters") or {}
+        if not isinstance(filters, dict):
+            return JSONResponse({"error": "filters must be an object"}, status_code=400)
+
+        with trace(question):
+            try:
+                payload = await answer(question, filters)
+            except Exception as e:
+                # Same contract as run_query: pipeline errors come back as an Error row
+                payload = {"question": question, "results": [["Error:", str(e)]]}
+
+            # Arrow IPC / MessagePack when asked for, JSON otherwise; large bodies are compressed
+            mime = negotiate(request.headers.get("accept")) if "columns" in payload else JSON_MIME
+            if mime == JSON_MIME:
+                with span("json_serialize"):
+                    body = JSONResponse(payload).body
+            else:
+                metadata = {"question": question, "sql_query": payload["sql_query"], "filters": payload["filters"]}
+                with span("binary_serialize"):
+                    body = encode_result(mime, payload["columns"], payload["results"], metadata)
+            body, encoding = compress(body, request.headers.get("accept-encoding"))
+            annotate(rows=len(payload["results"]), bytes=len(body))
+
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=mime, headers=headers)
+
+    except Exception as e:
+        print("❌ Exception in /ask endpoint:", e)
+        traceback.print_exc()
+        return JSONResponse({"error": "Internal Server Error"}, status_code=500)
+    finally:
+        _state["pending"] -= 1
+
+
+@app.get("/health")
+async def health():
+    pools = await run_in_db_thread(health_check)
+    healthy = all(pools.values()) and _state["accepting"]
+    return JSONResponse({
+        "healthy": healthy,
+        "warm": is_warm(),
+        "pools": pools,
+        "stats": pool_stats(),
+        "pending": _state["pending"],
+        "rejected": _state["rejected"],
+        "gemini": get_client().stats()
+    }, status_code=200 if healthy else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# ------------------------- #
+# Multi-worker launch: python asgi.py  (WEB_CONCURRENCY workers)
+# ------------------------- #
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app.asgi:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        timeout_graceful_shutdown=int(SHUTDOWN_GRACE_SECONDS)
+    )
@@ -0,0 +1,175 @@
+# app/async_gemini.py
+
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from app._gemini_connector import build_prompt, extract_sql, DB_PATH
+from app.metrics import span
+
+# Async Gemini access: identical in-flight prompts share one call (single-flight),
+# concurrency is capped by a semaphore and rate-limit errors are retried with backoff.
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", "8"))
+LATENCY_WINDOW = 1000
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    text = str(error).lower()
+    return "429" in text or "rate limit" in text or "quota" in text
+
+
+# --- Offline stand-in for load tests ---
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModel:
+    """
+    Local stub with the same generate_content / generate_content_async surface as
+    genai.GenerativeModel. Answers come from a {question: sql} mapping matched against
+    the "Question:" line of the prompt, with optional latency and injected rate limits.
+    Batch prompts get a JSON object of answers, like the real model is asked for.
+    """
+
+    def __init__(self, answers: dict = None, default_sql: str = "SELECT 1",
+                 latency: float = 0.05, rate_limit_ratio: float = 0.0):
+        self.answers = answers or {}
+        self.default_sql = default_sql
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.calls = 0
+
+    def _answer(self, prompt: str) -> FakeResponse:
+        self.calls += 1
+        if random.random() < self.rate_limit_ratio:
+            raise RuntimeError("429 Resource has been exhausted (fake rate limit)")
+        if "Questions (JSON):" in prompt:
+            questions = json.loads(prompt.rsplit("Questions (JSON):", 1)[-1].split("Answers (JSON):", 1)[0])
+            return FakeResponse(json.dumps({k: self.answers.get(q, self.default_sql) for k, q in questions.items()}))
+        question = prompt.rsplit("Question:", 1)[-1].split("SQL:", 1)[0].strip()
+        return FakeResponse(self.answers.get(question, self.default_sql))
+
+    def generate_content(self, prompt: str) -> FakeResponse:
+        time.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def generate_content_async(self, prompt: str) -> FakeResponse:
+        await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+
+# --- Client ---
+class AsyncGeminiClient:
+    def __init__(self, model=None, max_concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES):
+        self._model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._semaphore = None
+        self._in_flight = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {"requests": 0, "model_calls": 0, "coalesced": 0, "retries": 0, "errors": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            from app._gemini_connector import get_model
+            self._model = get_model()
+        return self._model
+
+    async def _call_model(self, prompt: str) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                start = time.perf_counter()
+                self._stats["model_calls"] += 1
+                try:
+                    response = await self.model.generate_content_async(prompt)
+                    return extract_sql(response)
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt >= self.max_retries:
+                        raise
+                finally:
+                    self._latencies.append(time.perf_counter() - start)
+
+            # Back off outside the semaphore so waiting calls don't hold a slot
+            attempt += 1
+            self._stats["retries"] += 1
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(0, delay))
+
+    async def ask(self, question: str, db_path: str = DB_PATH, failures: list = ()) -> str:
+        """
+        Async counterpart of ask_gemini: returns SQL for the question and raises
+        like ask_gemini does when the model fails or doesn't answer with a SELECT.
+        """
+        with span("prompt_build"):
+            prompt = build_prompt(question, db_path, failures)
+        self._stats["requests"] += 1
+
+        task = self._in_flight.get(prompt)
+        if task is None:
+            task = asyncio.ensure_future(self._call_model(prompt))
+            self._in_flight[prompt] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(prompt, None))
+        else:
+            self._stats["coalesced"] += 1
+
+        try:
+            # shield() keeps one cancelled caller from cancelling the shared call
+            with span("gemini_repair_call" if failures else "gemini_call"):
+                return await asyncio.shield(task)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {**self._stats, "in_flight": len(self._in_flight),
+                "latency_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99)}}
+
+
+_client = None
+
+
+def get_client() -> AsyncGeminiClient:
+    global _client
+    if _client is None:
+        _client = AsyncGeminiClient()
+    return _client
+
+
+async def ask_gemini_async(question: str, db_path: str = DB_PATH, failures: list = ()) -> str:
+    return await get_client().ask(question, db_path, failures)
+
+
+# ------------------------- #
+# Offline load test: python async_gemini.py
+# ------------------------- #
+if __name__ == "__main__":
+    async def load_test(total: int = 500, distinct: int = 20):
+        client = AsyncGeminiClient(FakeModel(latency=0.1, rate_limit_ratio=0.05))
+        questions = [f"question {i % distinct}" for i in range(total)]
+        start = time.perf_counter()
+        await asyncio.gather(*(client.ask(q) for q in questions), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        print(f"✅ {total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s)")
+        print(client.stats())
+
+    asyncio.run(load_test())
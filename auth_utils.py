@@ -1,37 +1,10 @@
 # streamlit_ui/auth_utils.py
 
-import sqlite3
-
-DB_NAME = "users.db"
+# Kept for older imports; users live in the single SQLite store in user_store.py
+from user_store import USER_DB_PATH as DB_NAME, init_store, add_user, validate_user
 
 def create_user_table():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-def add_user(username: str, password: str) -> bool:
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+    init_store()
 
 def verify_user(username: str, password: str) -> bool:
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
+    return validate_user(username, password)
@@ -0,0 +1,301 @@
+# app/benchmark.py
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import threading
+import itertools
+import urllib.request
+from contextlib import redirect_stdout
+
+# Offline benchmark of the question → SQL → result pipeline: Gemini is replaced by a
+# FakeModel answering from a fixture file, and queries run against synthetic databases
+# scaled from the shipped data. Results are written as JSON so runs can be compared.
+BENCH_DIR = os.getenv("BENCH_DIR", os.path.join("database", "bench"))
+FIXTURE_PATH = os.getenv("BENCH_FIXTURE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_questions.json"))
+
+# Keep the benchmark's SQL cache away from the real one
+os.environ.setdefault("SQL_CACHE_PATH", os.path.join(BENCH_DIR, "sql_cache.db"))
+
+# Row and item counts of the shipped datasets; synthetic databases are multiples of these
+BASE_ROWS = {"ad_sales_metrics": 3696, "total_sales_metrics": 702, "eligibility": 4381}
+BASE_ITEMS = {"ad_sales_metrics": 264, "total_sales_metrics": 90, "eligibility": 337}
+START_DAY = 20240  # 2025-06-01 in days since 1970-01-01
+INSERT_BATCH = 50000
+
+MESSAGES = [
+    "",
+    "This product's cost to Amazon does not allow us to meet customers' pricing expectations.",
+    "This product is not eligible for advertising because it is out of stock.",
+    "This product is in a restricted category.",
+]
+
+
+# --- Synthetic data ---
+def _rows(table: str, count: int, items: int, rng: random.Random):
+    # One row per (item, day), so (item_id, date) stays unique like the real exports
+    for i in range(count):
+        item, day = i % items, START_DAY + i // items
+        if table == "ad_sales_metrics":
+            impressions = rng.randint(0, 5000)
+            clicks = rng.randint(0, impressions // 40 + 1)
+            units = rng.randint(0, clicks)
+            yield (day, item, round(units * rng.uniform(5, 60), 2), impressions,
+                   round(clicks * rng.uniform(0.2, 2.5), 2), clicks, units)
+        elif table == "total_sales_metrics":
+            units = rng.randint(0, 12)
+            yield day, item, round(units * rng.uniform(5, 60), 2), units
+        else:
+            eligible = rng.random() < 0.8
+            yield day, item, int(eligible), "" if eligible else rng.choice(MESSAGES[1:])
+
+
+def build_synthetic_db(scale: int, rebuild: bool = False) -> str:
+    """
+    Creates database/bench/ecommerce_x<scale>.db with scale × the shipped row counts,
+    the same typed schema, indexes and rollups as db_loader. Existing files are reused.
+    """
+    from app.db_loader import COLUMN_TYPES, INDEXES, ROLLUP_SQL, ROLLUPS, STRICT, MESSAGE_FTS_SQL
+
+    path = os.path.join(BENCH_DIR, f"ecommerce_x{scale}.db")
+    if os.path.exists(path) and not rebuild:
+        return path
+
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    start = time.perf_counter()
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    rng = random.Random(scale)
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        for table, columns in COLUMN_TYPES.items():
+            column_defs = ", ".join(f'"{name}" {kind}' for name, kind in columns.items())
+            conn.execute(f'CREATE TABLE "{table}" ({column_defs}){STRICT}')
+            insert_sql = f'INSERT INTO "{table}" VALUES ({", ".join("?" for _ in columns)})'
+            rows = _rows(table, BASE_ROWS[table] * scale, BASE_ITEMS[table] * scale, rng)
+            while True:
+                batch = list(itertools.islice(rows, INSERT_BATCH))
+                if not batch:
+                    break
+                conn.executemany(insert_sql, batch)
+
+        for table, indexes in INDEXES.items():
+            for columns in indexes:
+                conn.execute(f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})")
+        for table, key in ROLLUPS.items():
+            conn.execute(ROLLUP_SQL.format(table=table, key=key))
+            conn.execute(f"CREATE UNIQUE INDEX idx_{table}_{key} ON {table} ({key})")
+        for statement in MESSAGE_FTS_SQL:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA user_version = 1")
+        conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    print(f"✅ Built {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MiB) in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+# --- Load generation ---
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return round(1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+    return {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99),
+            "max": round(1000 * latencies[-1], 3) if latencies else 0.0}
+
+
+def run_load(call, questions: list, clients: int, requests: int) -> dict:
+    """
+    Sends `requests` questions (round-robin over the fixture) from `clients` threads.
+    `call(question)` returns True on success.
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def client():
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                ok = call(questions[i % len(questions)])
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += 0 if ok else 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    return {"clients": clients, "requests": requests, "errors": errors[0], "seconds": round(seconds, 3),
+            "throughput_rps": round(requests / seconds, 2), "latency_ms": summarize(latencies)}
+
+
+def _is_error(results: list) -> bool:
+    return bool(results) and results[0][0] == "Error:"
+
+
+def bench_run_query(db_path: str, questions: list, clients: int, requests: int) -> dict:
+    from app.query_engine import run_query
+    return run_load(lambda q: not _is_error(run_query(q, db_path)), questions, clients, requests)
+
+
+def bench_http(db_path: str, questions: list, clients: int, requests: int) -> dict:
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import app.main as main
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    main.DB_PATH = db_path
+    server = make_server("127.0.0.1", 0, main.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/ask"
+
+    def ask(question):
+        request = urllib.request.Request(url, data=json.dumps({"question": question}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status == 200 and not _is_error(json.load(response)["results"])
+
+    try:
+        return run_load(ask, questions, clients, requests)
+    finally:
+        server.shutdown()
+
+
+TARGETS = {"run_query": bench_run_query, "http": bench_http}
+
+
+# --- Reporting ---
+def compare(results: list, baseline_path: str, max_regression: float) -> bool:
+    """
+    Prints throughput and p95 changes against a previous results file.
+    Returns False when any p95 latency got worse by more than max_regression percent.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["scale"], r["target"], r["clients"]): r for r in json.load(f)["results"]}
+
+    ok = True
+    print(f"\nComparison with {baseline_path}:")
+    for result in results:
+        before = baseline.get((result["scale"], result["target"], result["clients"]))
+        if before is None:
+            continue
+        rps = 100 * (result["throughput_rps"] / max(before["throughput_rps"], 1e-9) - 1)
+        p95 = 100 * (result["latency_ms"]["p95"] / max(before["latency_ms"]["p95"], 1e-9) - 1)
+        regressed = p95 > max_regression
+        ok = ok and not regressed
+        print(f"  {'❌' if regressed else '✅'} {result['scale']}× {result['target']}: "
+              f"throughput {rps:+.1f}%, p95 {p95:+.1f}%")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the ask pipeline")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--model-latency", type=float, default=0.0,
+                        help="seconds the fake model sleeps per call")
+    parser.add_argument("--no-intents", action="store_true",
+                        help="send every question to the model instead of the intent templates")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the synthetic databases")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="allowed p95 slowdown against the baseline, in percent")
+    args = parser.parse_args(argv)
+
+    import app._gemini_connector as gemini_connector
+    import app.intents as intents
+    from app.async_gemini import FakeModel
+    from app.sql_cache import clear_sql_cache, cache_stats
+    from app.result_cache import clear_result_cache, result_cache_stats
+
+    with open(FIXTURE_PATH, encoding="utf-8") as f:
+        answers = json.load(f)
+    questions = list(answers)
+    model = FakeModel(answers=answers, default_sql="SELECT 1", latency=args.model_latency)
+    gemini_connector.model = model
+    intents.INTENTS_ENABLED = not args.no_intents
+
+    results = []
+    for scale in args.scales:
+        db_path = build_synthetic_db(scale, rebuild=args.rebuild)
+        for target in args.targets:
+            # Every run starts cold: first sightings of a question go to the model and SQLite
+            clear_sql_cache()
+            clear_result_cache()
+            sql_before, rows_before, calls_before = cache_stats(), result_cache_stats(), model.calls
+
+            # The pipeline prints every SQL statement; keep that out of the report
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = TARGETS[target](db_path, questions, args.clients, args.requests)
+
+            sql_after, rows_after = cache_stats(), result_cache_stats()
+            result = {"scale": scale, "target": target, "db_bytes": os.path.getsize(db_path), **result,
+                      "model_calls": model.calls - calls_before,
+                      "sql_cache_hits": sql_after["hits"] - sql_before["hits"],
+                      "result_cache_hits": rows_after["hits"] - rows_before["hits"]}
+            results.append(result)
+            latency = result["latency_ms"]
+            print(f"{scale:>5}× {target:<9} {result['throughput_rps']:>9.1f} req/s  "
+                  f"p50 {latency['p50']:.1f}ms  p95 {latency['p95']:.1f}ms  p99 {latency['p99']:.1f}ms  "
+                  f"errors {result['errors']}")
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "settings": {"clients": args.clients, "requests": args.requests, "model_latency": args.model_latency,
+                     "intents": not args.no_intents,
+                     "fixture": FIXTURE_PATH, "questions": len(questions)},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+
+    if args.baseline and not compare(results, args.baseline, args.max_regression):
+        return 1
+    return 0
+
+
+# ------------------------- #
+# python benchmark.py --scales 10 100 --clients 16 --requests 1000
+# python benchmark.py --baseline database/bench/results-<previous>.json
+# ------------------------- #
+if __name__ == "__main__":
+    sys.exit(main())
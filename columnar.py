@@ -0,0 +1,113 @@
+# app/columnar.py
+
+import os
+import re
+import threading
+from app.db_pool import connection
+
+# Optional DuckDB execution over the Arrow mirror written by db_loader.
+# Enabled with COLUMNAR_ENGINE=duckdb; anything it can't run falls back to SQLite.
+COLUMNAR_ENGINE = os.getenv("COLUMNAR_ENGINE", "").lower()
+MIRROR_DIR = os.getenv("MIRROR_DIR", os.path.join("database", "mirror"))
+
+# Only aggregations over at least this many mirrored rows are worth routing
+COLUMNAR_MIN_ROWS = int(os.getenv("COLUMNAR_MIN_ROWS", "100000"))
+
+# Differences between SQLite and DuckDB and how they are handled:
+# - functions missing or behaving differently in DuckDB: calls to them stay on SQLite
+#   (bare identifiers such as a `date` column or an `AS total` alias are fine)
+# - LIKE is case-insensitive in SQLite and case-sensitive in DuckDB; GLOB differs too: stays on SQLite
+# - integer division and NULL ordering (NULLs first on ASC, last on DESC) are set to SQLite's in execute_columnar
+# - row order without ORDER BY (e.g. GROUP BY alone) is unspecified and may differ between the engines
+# - unaliased expressions are named differently (COUNT(*) becomes count_star()): names are taken from SQLite
+# - decimal literals make DECIMAL results (0.5 * SUM(x)), which come back as Decimal: converted to float
+_SQLITE_ONLY = re.compile(
+    r"\b(?:strftime|julianday|date|datetime|time|unixepoch|printf|ifnull|group_concat|instr|substr|"
+    r"total|typeof|iif)\s*\(",
+    re.IGNORECASE
+)
+_SQLITE_OPERATORS = re.compile(r"\b(?:like|glob)\b", re.IGNORECASE)
+_AGGREGATE = re.compile(r"\b(group\s+by|sum|avg|count|min|max)\b", re.IGNORECASE)
+_TABLE_REF = re.compile(r"\b(?:from|join)\s+[\"`\[]?(\w+)", re.IGNORECASE)
+
+_lock = threading.Lock()
+_mirror = {"version": None, "tables": {}}
+
+
+def _load_mirror():
+    """
+    Memory-maps every Arrow file in the mirror once per data version.
+    Returns (version, {table: pyarrow.Table}).
+    """
+    import pyarrow as pa
+
+    version_file = os.path.join(MIRROR_DIR, "VERSION")
+    if not os.path.exists(version_file):
+        return None, {}
+    with open(version_file) as f:
+        version = int(f.read().strip())
+
+    with _lock:
+        if _mirror["version"] != version:
+            tables = {}
+            for name in os.listdir(MIRROR_DIR):
+                if name.endswith(".arrow"):
+                    source = pa.memory_map(os.path.join(MIRROR_DIR, name), "r")
+                    tables[name[:-len(".arrow")]] = pa.ipc.open_file(source).read_all()
+            _mirror.update(version=version, tables=tables)
+        return _mirror["version"], _mirror["tables"]
+
+
+def can_use_columnar(sql_query: str, db_path: str) -> bool:
+    """
+    True when the columnar engine is enabled, the mirror matches the current data version,
+    and the query is a heavy aggregation that only touches mirrored tables.
+    """
+    if COLUMNAR_ENGINE != "duckdb":
+        return False
+    if not _AGGREGATE.search(sql_query) or _SQLITE_ONLY.search(sql_query) or _SQLITE_OPERATORS.search(sql_query):
+        return False
+    try:
+        import duckdb  # noqa: F401
+        version, tables = _load_mirror()
+    except ImportError:
+        return False
+
+    with connection(db_path) as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+            return False
+
+    referenced = {name.lower() for name in _TABLE_REF.findall(sql_query)}
+    if not referenced or not referenced.issubset(tables):
+        return False
+    return sum(tables[name].num_rows for name in referenced) >= COLUMNAR_MIN_ROWS
+
+
+def execute_columnar(sql_query: str, conn) -> tuple[list, list]:
+    """
+    Runs the query with DuckDB over the memory-mapped Arrow tables. conn is a SQLite
+    connection to the same data, used only to name the columns the way SQLite would.
+    Returns (column_names, rows) with DECIMAL values as floats, like SQLite's REAL.
+    """
+    import duckdb
+
+    columns = [col[0] for col in conn.execute(f"SELECT * FROM ({sql_query}) LIMIT 0").description]
+
+    _, tables = _load_mirror()
+    duck = duckdb.connect()
+    try:
+        # Match SQLite: integer / integer stays an integer, NULLs sort as the smallest value
+        duck.execute("SET integer_division = true")
+        duck.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+        for name, table in tables.items():
+            duck.register(name, table)
+        cursor = duck.execute(sql_query)
+        decimals = [i for i, col in enumerate(cursor.description or []) if str(col[1]).startswith("DECIMAL")]
+        rows = cursor.fetchall()
+    finally:
+        duck.close()
+
+    if decimals:
+        rows = [tuple(float(v) if i in decimals and v is not None else v for i, v in enumerate(row))
+                for row in rows]
+    return columns, rows
@@ -1,76 +1,382 @@
 # app/db_loader.py
 
 import os
+import sys
+import time
+import sqlite3
 import pandas as pd
-from sqlalchemy import create_engine
+from concurrent.futures import ProcessPoolExecutor
+from app.inspect_db import MESSAGE_FTS_TABLE
 
-# Create output directory if it doesn't exist
-os.makedirs("database", exist_ok=True)
+DB_PATH = "database/ecommerce.db"
+_engine = None
 
-# Connect to SQLite database (will create ecommerce.db if it doesn't exist)
-engine = create_engine("sqlite:///database/ecommerce.db")
+
+# Connect to SQLite database on first use (will create database/ecommerce.db if it doesn't exist),
+# so importing this module for its constants has no side effects
+def get_engine():
+    global _engine
+    if _engine is None:
+        from sqlalchemy import create_engine
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        _engine = create_engine(f"sqlite:///{DB_PATH}")
+    return _engine
+
+
+# Rows per chunk when streaming CSVs; peak memory per dataset is bounded by this
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "50000"))
+
+DATASETS = [
+    ("Product-Level Eligibility Table.csv", "eligibility", ["eligibility_datetime_utc"], "%m/%d/%y"),
+    ("Product-Level Ad Sales and Metrics.csv", "ad_sales_metrics", ["date"], "%m/%d/%y"),
+    ("Product-Level Total Sales and Metrics.csv", "total_sales_metrics", ["date"], "%m/%d/%y"),
+]
 
 
 # Helper Function to Clean Data
-def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+def clean_dataframe(df: pd.DataFrame, drop_empty_columns: bool = True) -> pd.DataFrame:
     # Strip whitespace from column names
     df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
 
-    # Remove columns with all NaNs
-    df.dropna(axis=1, how='all', inplace=True)
+    # Remove columns with all NaNs (skipped per chunk, where a column may only be empty locally)
+    if drop_empty_columns:
+        df.dropna(axis=1, how='all', inplace=True)
 
     # Remove rows with all NaNs
     df.dropna(axis=0, how='all', inplace=True)
 
-    # Fill remaining NaNs with placeholder (optional)
-    df.fillna(value="", inplace=True)
+    # Fill remaining NaNs in text columns with a placeholder; numeric columns keep NULLs
+    # so they stay numeric instead of turning into mixed-type TEXT
+    text_columns = df.select_dtypes(include="object").columns
+    df[text_columns] = df[text_columns].fillna(value="")
 
     return df
 
 
-# Load, clean, and optionally convert dates for specific tables
-def load_and_store_csv(filename: str, table_name: str, date_columns: list = None, date_format: str = None):
+# Dates are stored as INTEGER days since 1970-01-01 so range filters are plain integer comparisons
+def to_epoch_days(values: pd.Series, date_format: str) -> pd.Series:
+    dates = pd.to_datetime(values, format=date_format, errors='coerce')
+    return ((dates - pd.Timestamp("1970-01-01")) // pd.Timedelta(days=1)).astype("Int64")
+
+
+# STRICT tables (SQLite 3.37+) reject values that don't match the declared column type
+STRICT = " STRICT" if sqlite3.sqlite_version_info >= (3, 37, 0) else ""
+
+
+# Declared column types per table. They are fixed rather than read from pandas dtypes:
+# a chunk where a text column is empty would otherwise declare it REAL and later chunks fail.
+COLUMN_TYPES = {
+    "eligibility": {"eligibility_datetime_utc": "INTEGER", "item_id": "INTEGER",
+                    "eligibility": "INTEGER", "message": "TEXT"},
+    "ad_sales_metrics": {"date": "INTEGER", "item_id": "INTEGER", "ad_sales": "REAL",
+                         "impressions": "INTEGER", "ad_spend": "REAL", "clicks": "INTEGER",
+                         "units_sold": "INTEGER"},
+    "total_sales_metrics": {"date": "INTEGER", "item_id": "INTEGER", "total_sales": "REAL",
+                            "total_units_ordered": "INTEGER"},
+}
+
+
+def _sql_type(table_name: str, column: str, date_columns: list) -> str:
+    if column in date_columns:
+        return "INTEGER"
+    declared = COLUMN_TYPES.get(table_name, {}).get(column)
+    if declared:
+        return declared
+    # Columns outside the known schema keep whatever values they hold
+    print(f"⚠ `{table_name}.{column}` is not in COLUMN_TYPES; storing it untyped")
+    return "ANY" if STRICT else ""
+
+
+def _latest_date(table_name: str, date_column: str):
+    if not os.path.exists(DB_PATH):
+        return None
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+        ).fetchone()
+        return conn.execute(f"SELECT MAX({date_column}) FROM {table_name}").fetchone()[0] if exists else None
+    finally:
+        conn.close()
+
+
+# Stream one CSV in chunks into its own staging database (safe to run in parallel processes)
+def stage_csv(filename: str, table_name: str, date_columns: list = None, date_format: str = None,
+              incremental: bool = False, chunksize: int = CHUNK_SIZE) -> tuple:
     filepath = os.path.join("data", filename)
-    print(f"Processing {filepath} → table `{table_name}`...")
+    staging_path = os.path.join("database", f"staging_{table_name}.db")
+    date_columns = date_columns or []
+    since = _latest_date(table_name, date_columns[0]) if incremental and date_columns else None
+    print(f"Processing {filepath} → table `{table_name}`" + (f" (rows from {since})" if since else "") + "...")
+
+    os.makedirs("database", exist_ok=True)
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+    conn = sqlite3.connect(staging_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    columns, total = None, 0
+    try:
+        conn.execute("BEGIN")
+        for chunk in pd.read_csv(filepath, encoding="ISO-8859-1", chunksize=chunksize):
+            chunk = clean_dataframe(chunk, drop_empty_columns=False)
+
+            # Convert date columns if specified
+            if date_format:
+                for col in date_columns:
+                    if col in chunk.columns:
+                        chunk[col] = to_epoch_days(chunk[col], date_format)
+
+            if columns is None:
+                columns = list(chunk.columns)
+                types = {c: _sql_type(table_name, c, date_columns) for c in columns}
+                column_defs = ", ".join(f'"{c}" {types[c]}' for c in columns)
+                conn.execute(f'CREATE TABLE "{table_name}" ({column_defs}){STRICT}')
+                insert_sql = f'INSERT INTO "{table_name}" VALUES ({", ".join("?" for _ in columns)})'
+                text_columns = [c for c in columns if types[c] == "TEXT"]
+
+            chunk = chunk.reindex(columns=columns)
+            # A text column that is empty throughout a chunk is read as float NaN; store "" like other chunks
+            chunk[text_columns] = chunk[text_columns].astype(object).fillna(value="")
+            # The latest stored day is re-read too, since exports for it may have been partial
+            if since is not None:
+                chunk = chunk[chunk[date_columns[0]] >= since]
+
+            rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+            conn.executemany(insert_sql, rows)
+            total += len(chunk)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return table_name, staging_path, columns, total
+
+
+# Move a staged table into ecommerce.db: replace it, or upsert on (item_id, date) when incremental
+def merge_staging(table_name: str, staging_path: str, columns: list, key: tuple = None, incremental: bool = False):
+    conn = sqlite3.connect(DB_PATH, timeout=60, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS staging", (staging_path,))
+        exists = conn.execute(
+            "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+        ).fetchone()
+        column_list = ", ".join(f'"{c}"' for c in columns)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if incremental and exists:
+                if key:
+                    match = " AND ".join(f's."{k}" IS t."{k}"' for k in key)
+                    conn.execute(f'CREATE INDEX staging.idx_upsert ON "{table_name}" ({", ".join(key)})')
+                    # Last row wins within the batch as well
+                    conn.execute(
+                        f'DELETE FROM staging."{table_name}" WHERE rowid NOT IN '
+                        f'(SELECT MAX(rowid) FROM staging."{table_name}" GROUP BY {", ".join(key)})'
+                    )
+                    conn.execute(
+                        f'DELETE FROM main."{table_name}" AS t WHERE EXISTS '
+                        f'(SELECT 1 FROM staging."{table_name}" AS s WHERE {match})'
+                    )
+            else:
+                schema = conn.execute(
+                    "SELECT sql FROM staging.sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+                ).fetchone()[0]
+                conn.execute(f'DROP TABLE IF EXISTS main."{table_name}"')
+                conn.execute(schema)
+            conn.execute(
+                f'INSERT INTO main."{table_name}" ({column_list}) '
+                f'SELECT {column_list} FROM staging."{table_name}"'
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("DETACH DATABASE staging")
+    finally:
+        conn.close()
+    os.remove(staging_path)
+
+
+# Load, clean, and optionally convert dates for specific tables
+def load_and_store_csv(filename: str, table_name: str, date_columns: list = None, date_format: str = None,
+                       incremental: bool = False):
+    table_name, staging_path, columns, total = stage_csv(
+        filename, table_name, date_columns, date_format, incremental=incremental
+    )
+    key = ("item_id", date_columns[0]) if date_columns and "item_id" in columns else None
+    merge_staging(table_name, staging_path, columns, key=key, incremental=incremental)
+    print(f"✅ Loaded `{table_name}` ({total} {'upserted ' if incremental else ''}rows)")
 
-    df = pd.read_csv(filepath, encoding="ISO-8859-1")
 
-    df = clean_dataframe(df)
+# Stage all datasets in parallel processes, then merge them one at a time
+def load_all(incremental: bool = False, parallel: bool = True):
+    start = time.perf_counter()
+    jobs = [(f, t, d, fmt, incremental) for f, t, d, fmt in DATASETS]
 
-    # Convert date columns if specified
-    if date_columns and date_format:
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], format=date_format, errors='coerce').dt.date
+    if parallel:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            staged = list(pool.map(stage_csv, *zip(*jobs)))
+    else:
+        staged = [stage_csv(*job) for job in jobs]
 
-    # Save to SQL
-    df.to_sql(table_name, engine, index=False, if_exists="replace")
-    print(f"✅ Loaded `{table_name}` ({len(df)} rows)")
+    for (_, _, date_columns, _), (table_name, staging_path, columns, total) in zip(DATASETS, staged):
+        key = ("item_id", date_columns[0]) if "item_id" in columns else None
+        merge_staging(table_name, staging_path, columns, key=key, incremental=incremental)
+        print(f"✅ Loaded `{table_name}` ({total} {'upserted ' if incremental else ''}rows)")
+
+    print(f"✅ Ingested {len(jobs)} datasets in {time.perf_counter() - start:.2f}s")
+
+
+# Indexes for the filters and joins generated SQL uses most (item_id, date)
+INDEXES = {
+    "ad_sales_metrics": [("item_id", "date"), ("date",)],
+    "total_sales_metrics": [("item_id", "date"), ("date",)],
+    # message is looked up with the FTS matches of the /ask message filter
+    "eligibility": [("item_id", "eligibility_datetime_utc"), ("eligibility_datetime_utc",), ("message",)],
+}
+
+# Each side is aggregated on its own before joining, so items with many ad rows
+# don't multiply the total sales rows.
+ROLLUP_SQL = """
+CREATE TABLE {table} AS
+WITH t AS (
+    SELECT {key}, SUM(total_sales) AS total_sales, SUM(total_units_ordered) AS total_units_ordered
+    FROM total_sales_metrics GROUP BY {key}
+),
+a AS (
+    SELECT {key}, SUM(ad_sales) AS ad_sales, SUM(ad_spend) AS ad_spend, SUM(clicks) AS clicks,
+           SUM(impressions) AS impressions, SUM(units_sold) AS units_sold
+    FROM ad_sales_metrics GROUP BY {key}
+),
+k AS (SELECT {key} FROM t UNION SELECT {key} FROM a)
+SELECT k.{key}, t.total_sales, t.total_units_ordered, a.ad_sales, a.ad_spend,
+       a.clicks, a.impressions, a.units_sold,
+       ROUND(1.0 * a.clicks / NULLIF(a.impressions, 0), 6) AS ctr,
+       ROUND(a.ad_spend / NULLIF(a.clicks, 0), 4) AS cpc,
+       ROUND(a.ad_sales / NULLIF(a.ad_spend, 0), 4) AS roas
+FROM k
+LEFT JOIN t ON t.{key} IS k.{key}
+LEFT JOIN a ON a.{key} IS k.{key}
+ORDER BY k.{key}
+"""
+
+ROLLUPS = {"daily_sales_rollup": "date", "item_sales_rollup": "item_id"}
+
+# Full-text index over the distinct eligibility messages (there are far fewer messages than rows),
+# used by the /ask message filter; needs SQLite built with FTS5
+MESSAGE_FTS_SQL = [
+    f"DROP TABLE IF EXISTS {MESSAGE_FTS_TABLE}",
+    f"CREATE VIRTUAL TABLE {MESSAGE_FTS_TABLE} USING fts5(message)",
+    f"INSERT INTO {MESSAGE_FTS_TABLE} (message) SELECT DISTINCT message FROM eligibility WHERE message <> ''",
+]
+
+
+# Create indexes and rollup tables, then refresh planner statistics
+def build_indexes_and_rollups():
+    start = time.perf_counter()
+    with get_engine().begin() as conn:
+        for table, indexes in INDEXES.items():
+            for columns in indexes:
+                name = f"idx_{table}_{'_'.join(columns)}"
+                conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+        for table, key in ROLLUPS.items():
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+            conn.exec_driver_sql(ROLLUP_SQL.format(table=table, key=key))
+            conn.exec_driver_sql(f"CREATE UNIQUE INDEX idx_{table}_{key} ON {table} ({key})")
+
+        try:
+            for statement in MESSAGE_FTS_SQL:
+                conn.exec_driver_sql(statement)
+        except Exception as e:
+            print(f"ℹ Skipping the message search index (FTS5 unavailable?): {e}")
+
+        conn.exec_driver_sql("ANALYZE")
+    print(f"✅ Built indexes and rollups in {time.perf_counter() - start:.2f}s")
+
+    # Report rows and on-disk size per table (dbstat is not compiled into every SQLite build)
+    with get_engine().connect() as conn:
+        try:
+            sizes = dict(conn.exec_driver_sql(
+                "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"
+            ).fetchall())
+        except Exception:
+            sizes = {}
+        for table in list(INDEXES) + list(ROLLUPS):
+            rows = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+            size = f", {sizes[table] / 1024:.0f} KiB" if table in sizes else ""
+            print(f"   `{table}`: {rows} rows{size}")
+
+
+# Optional Arrow IPC mirror of every table; files can be memory-mapped by the columnar engine
+MIRROR_DIR = os.path.join("database", "mirror")
+
+
+def _arrow_type(pa, declared: str):
+    # Same precedence as SQLite's column affinity rules
+    declared = declared.upper()
+    if "INT" in declared:
+        return pa.int64()
+    if any(t in declared for t in ("CHAR", "CLOB", "TEXT")):
+        return pa.string()
+    return pa.float64()
+
+
+def export_mirror(version: int):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print("ℹ pyarrow is not installed; skipping the Arrow mirror")
+        return
+
+    start = time.perf_counter()
+    os.makedirs(MIRROR_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        for table in [t for _, t, _, _ in DATASETS] + list(ROLLUPS):
+            info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            schema = pa.schema([(col[1], _arrow_type(pa, col[2])) for col in info])
+            path = os.path.join(MIRROR_DIR, f"{table}.arrow")
+
+            cursor = conn.execute(f'SELECT * FROM "{table}"')
+            with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+                while True:
+                    rows = cursor.fetchmany(CHUNK_SIZE)
+                    if not rows:
+                        break
+                    arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+            os.replace(path + ".tmp", path)
+    finally:
+        conn.close()
+
+    with open(os.path.join(MIRROR_DIR, "VERSION"), "w") as f:
+        f.write(str(version))
+    print(f"✅ Exported Arrow mirror to {MIRROR_DIR} in {time.perf_counter() - start:.2f}s")
+
+
+# Bump PRAGMA user_version so caches keyed on the schema fingerprint are invalidated
+def bump_data_version() -> int:
+    with get_engine().begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar() + 1
+        conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+    # WAL lets the read-only query pool keep reading while the loader writes
+    with get_engine().connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+    return version
 
 
 # ------------------------- #
 # Run for All 3 Datasets
+#   python db_loader.py                 full reload
+#   python db_loader.py --incremental   only rows from the stored max date on, upserted on (item_id, date)
 # ------------------------- #
 if __name__ == "__main__":
-    load_and_store_csv(
-        "Product-Level Eligibility Table.csv",
-        "eligibility",
-        date_columns=["eligibility_datetime_utc"],
-        date_format="%m/%d/%y"  # if needed
-    )
-
-    load_and_store_csv(
-        "Product-Level Ad Sales and Metrics.csv",
-        "ad_sales_metrics",
-        date_columns=["date"],
-        date_format="%m/%d/%y"
-    )
-
-    load_and_store_csv(
-        "Product-Level Total Sales and Metrics.csv",
-        "total_sales_metrics",
-        date_columns=["date"],
-        date_format="%m/%d/%y"
-    )
+    incremental = "--incremental" in sys.argv
+    load_all(incremental=incremental, parallel="--serial" not in sys.argv)
 
-    print("\n✅ All datasets have been loaded into ecommerce.db")
+    build_indexes_and_rollups()
+    version = bump_data_version()
+    export_mirror(version)
+    print(f"\n✅ All datasets have been loaded into ecommerce.db (data version {version})")
@@ -0,0 +1,201 @@
+# app/db_pool.py
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# Shared SQLite connection pools, one per (database, mode).
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Connections idle for longer than this are pinged before being handed out
+HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+# Per-connection prepared statement cache (sqlite3 keeps compiled statements by SQL text)
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+    """
+    A bounded LIFO pool of SQLite connections. Each connection is used by one thread at a
+    time, and the most recently returned one is handed out first so its page cache stays warm.
+    Read-only pools open the file with mode=ro and PRAGMA query_only, so generated SQL
+    can never modify the data.
+    """
+
+    def __init__(self, db_path: str, readonly: bool = True, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.size = size
+        self.name = f"{db_path} ({'ro' if readonly else 'rw'})"
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                       "timeouts": 0, "replaced": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.readonly:
+            uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=POOL_TIMEOUT,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        start = time.perf_counter()
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                conn, last_used = None, None
+            else:
+                try:
+                    conn, last_used = self._idle.get(timeout=POOL_TIMEOUT)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No free connection for {self.db_path} after {POOL_TIMEOUT}s")
+
+        if conn is not None and time.monotonic() - last_used > HEALTH_CHECK_INTERVAL \
+                and not self._is_healthy(conn):
+            conn.close()
+            conn = None
+            with self._lock:
+                self._stats["replaced"] += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def health_check(self) -> bool:
+        with self.connection() as conn:
+            return self._is_healthy(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._created
+        stats["idle"] = self._idle.qsize()
+        stats["avg_wait_ms"] = round(1000 * stats["wait_seconds"] / stats["checkouts"], 3) \
+            if stats["checkouts"] else 0.0
+        return stats
+
+    def close_all(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str, readonly: bool = True) -> ConnectionPool:
+    key = (os.path.abspath(db_path), readonly)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path, readonly=readonly)
+        return _pools[key]
+
+
+@contextmanager
+def connection(db_path: str, readonly: bool = True):
+    """
+    Borrows a pooled connection for the duration of a with-block.
+    """
+    with get_pool(db_path, readonly).connection() as conn:
+        yield conn
+
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {p.name: p.stats() for p in pools}
+
+
+def health_check() -> dict:
+    """
+    Pings one connection from every pool. Returns {pool_name: healthy}.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    result = {}
+    for p in pools:
+        try:
+            result[p.name] = p.health_check()
+        except Exception:
+            result[p.name] = False
+    return result
+
+
+def close_all_pools():
+    with _pools_lock:
+        for p in _pools.values():
+            p.close_all()
+        _pools.clear()
@@ -0,0 +1,148 @@
+# app/encoding.py
+
+import os
+import gzip
+import json
+
+# Response formats for /ask, picked from the Accept header. The binary formats carry
+# column names, dtypes and the answer metadata, and are encoded column by column.
+JSON_MIME = "application/json"
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+MSGPACK_MIME = "application/x-msgpack"
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", str(32 * 1024)))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("RESPONSE_ZSTD_LEVEL", "3"))
+
+# Metadata key on the Arrow schema holding the JSON answer metadata
+ARROW_METADATA_KEY = b"ask"
+
+_installed = {}
+
+
+def _available(module: str) -> bool:
+    if module not in _installed:
+        try:
+            __import__(module)
+            _installed[module] = True
+        except ImportError:
+            _installed[module] = False
+    return _installed[module]
+
+
+def _accepted(header: str) -> list:
+    """
+    Media types or codings from an Accept / Accept-Encoding header, best first; q=0 entries are dropped.
+    """
+    entries = []
+    for position, part in enumerate((header or "").split(",")):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            entries.append((-quality, position, name.strip().lower()))
+    return [name for _, _, name in sorted(entries)]
+
+
+def negotiate(accept: str) -> str:
+    """
+    Response format for an Accept header: Arrow IPC or MessagePack when asked for and
+    installed (pyarrow / msgpack), JSON otherwise.
+    """
+    for mime in _accepted(accept):
+        if mime == ARROW_MIME and _available("pyarrow"):
+            return ARROW_MIME
+        if mime == MSGPACK_MIME and _available("msgpack"):
+            return MSGPACK_MIME
+        if mime in (JSON_MIME, "application/*", "*/*"):
+            return JSON_MIME
+    return JSON_MIME
+
+
+# --- Columns ---
+def _dtype(values: list) -> str:
+    # SQLite types are per value, so a column is typed by what it actually holds
+    kinds = {type(v) for v in values if v is not None}
+    if not kinds:
+        return "null"
+    if kinds == {int}:
+        return "int64"
+    if kinds <= {int, float}:
+        return "float64"
+    if kinds == {str}:
+        return "string"
+    if kinds == {bytes}:
+        return "binary"
+    return "string"  # mixed column, sent as text
+
+
+def to_columns(columns: list, rows: list) -> tuple[list, list]:
+    """
+    Transposes rows into per-column lists and returns (data, dtypes). Mixed columns become text.
+    """
+    data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    dtypes = [_dtype(values) for values in data]
+    for i, dtype in enumerate(dtypes):
+        if dtype == "float64":
+            data[i] = [None if v is None else float(v) for v in data[i]]
+        elif dtype == "string":
+            data[i] = [None if v is None else str(v) for v in data[i]]
+    return data, dtypes
+
+
+# --- Encoders ---
+def encode_arrow(columns: list, rows: list, metadata: dict) -> bytes:
+    import pyarrow as pa
+
+    types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(),
+             "binary": pa.binary(), "null": pa.null()}
+    data, dtypes = to_columns(columns, rows)
+    # Duplicate names (e.g. two "date" columns from a join) are allowed in Arrow IPC
+    arrays = [pa.array(values, type=types[dtype]) for values, dtype in zip(data, dtypes)]
+    schema = pa.schema([pa.field(name, array.type) for name, array in zip(columns, arrays)],
+                       metadata={ARROW_METADATA_KEY: json.dumps(metadata, default=str).encode("utf-8")})
+    batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_msgpack(columns: list, rows: list, metadata: dict) -> bytes:
+    import msgpack
+
+    data, dtypes = to_columns(columns, rows)
+    return msgpack.packb({**metadata, "columns": columns, "dtypes": dtypes, "data": data},
+                         use_bin_type=True, default=str)
+
+
+def encode_result(mime: str, columns: list, rows: list, metadata: dict) -> bytes:
+    # Binary formats only; JSON responses keep their existing shape
+    if mime == ARROW_MIME:
+        return encode_arrow(columns, rows, metadata)
+    return encode_msgpack(columns, rows, metadata)
+
+
+# --- Compression ---
+def compress(body: bytes, accept_encoding: str) -> tuple[bytes, str]:
+    """
+    Compresses bodies above COMPRESS_MIN_BYTES with zstd (if `zstandard` is installed)
+    or gzip, whichever the client accepts first. Returns (body, content_encoding or None).
+    """
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    for coding in _accepted(accept_encoding):
+        if coding == "zstd" and _available("zstandard"):
+            import zstandard
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+        if coding in ("gzip", "x-gzip"):
+            return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
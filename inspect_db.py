@@ -1,18 +1,107 @@
-import sqlite3
+# app/inspect_db.py
 
-conn = sqlite3.connect("database/ecommerce.db")
-cursor = conn.cursor()
+import os
+import sys
+from datetime import date, timedelta
+from app.db_pool import connection
 
-# List all tables
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tables = cursor.fetchall()
-print("Tables:", tables)
+# Schema introspection shared by the Gemini prompt and this script.
+# Min/max ranges cover the whole table; distinct counts of text columns come from the
+# first SCHEMA_SAMPLE_ROWS rows of each table.
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "100000"))
 
-# Show columns for each table
-for table in tables:
-    print(f"\nSchema for table: {table[0]}")
-    cursor.execute(f"PRAGMA table_info({table[0]});")
-    for col in cursor.fetchall():
-        print(col)
+EPOCH = date(1970, 1, 1)
 
-conn.close()
+# FTS5 index over the distinct eligibility messages, built by db_loader for message filters
+MESSAGE_FTS_TABLE = "eligibility_message_fts"
+
+
+def _is_date_column(name: str, kind: str) -> bool:
+    # db_loader stores dates as INTEGER days since 1970-01-01
+    return "INT" in kind.upper() and (name == "date" or name.endswith("_date") or "datetime" in name)
+
+
+def inspect_schema(db_path: str = "database/ecommerce.db", sample_rows: int = SCHEMA_SAMPLE_ROWS) -> list[dict]:
+    """
+    Returns one {"name", "rows", "columns"} entry per table, where each column has its
+    declared type and either a min/max range or, for text, the number of distinct values.
+    """
+    tables = []
+    with connection(db_path) as conn:
+        names = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+            "AND name NOT LIKE ? ORDER BY name", (MESSAGE_FTS_TABLE + "%",)
+        )]
+        for table in names:
+            columns = [{"name": col[1], "type": col[2] or "NUMERIC"}
+                       for col in conn.execute(f'PRAGMA table_info("{table}")')]
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+            for col in columns:
+                name = col["name"].replace('"', '""')
+                if "TEXT" in col["type"].upper():
+                    col["distinct"] = conn.execute(
+                        f'SELECT COUNT(DISTINCT "{name}") FROM (SELECT "{name}" FROM "{table}" LIMIT ?)',
+                        (sample_rows,)
+                    ).fetchone()[0]
+                else:
+                    # A lone MIN or MAX per query is answered from an index on the column when there is one
+                    col["min"] = conn.execute(f'SELECT MIN("{name}") FROM "{table}"').fetchone()[0]
+                    col["max"] = conn.execute(f'SELECT MAX("{name}") FROM "{table}"').fetchone()[0]
+                    col["is_date"] = _is_date_column(col["name"], col["type"])
+            tables.append({"name": table, "rows": rows, "columns": columns})
+    return tables
+
+
+def _format_value(value, is_date: bool = False) -> str:
+    if is_date and isinstance(value, int):
+        return (EPOCH + timedelta(days=value)).isoformat()
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def _short_type(kind: str) -> str:
+    kind = kind.upper()
+    if "INT" in kind:
+        return "int"
+    if "TEXT" in kind or "CHAR" in kind:
+        return "text"
+    return "real" if "REAL" in kind or "FLOA" in kind else "num"
+
+
+def _show_range(col: dict) -> bool:
+    # Ranges are only worth their tokens for dates, keys and small integer codes
+    if col.get("min") is None:
+        return False
+    if col["is_date"] or col["name"].endswith("_id"):
+        return True
+    return isinstance(col["min"], int) and isinstance(col["max"], int) and col["max"] - col["min"] <= 10
+
+
+def describe_schema(tables: list[dict]) -> str:
+    """
+    Compact one-line-per-table descriptor, e.g.
+    - ad_sales_metrics (3696 rows): date int 2025-06-01..2025-06-14, item_id int 0..263, ad_sales real, ...
+    """
+    lines = []
+    for table in tables:
+        parts = []
+        for col in table["columns"]:
+            text = f'{col["name"]} {_short_type(col["type"])}'
+            if "distinct" in col:
+                text += f' ({col["distinct"]} distinct)'
+            elif _show_range(col):
+                low = _format_value(col["min"], col["is_date"])
+                high = _format_value(col["max"], col["is_date"])
+                text += f" {low}..{high}"
+            parts.append(text)
+        lines.append(f'- {table["name"]} ({table["rows"]} rows): {", ".join(parts)}')
+    return "\n".join(lines)
+
+
+# ------------------------- #
+# python inspect_db.py [path/to/ecommerce.db]
+# ------------------------- #
+if __name__ == "__main__":
+    print(describe_schema(inspect_schema(sys.argv[1] if len(sys.argv) > 1 else "database/ecommerce.db")))
@@ -0,0 +1,381 @@
+# app/intents.py
+
+import os
+import re
+import threading
+from datetime import date
+from app.db_pool import connection
+from app.sql_cache import schema_fingerprint
+from app.metrics import span, annotate
+
+# Rule-based fast path: common questions ("total sales trend over time", "top 5 items by
+# impressions", ...) are matched against templates and turned into parameterized SQL
+# without a Gemini call. Anything the templates can't explain goes to the model.
+INTENTS_ENABLED = os.getenv("INTENTS_ENABLED", "1") == "1"
+# Share of the question's words a template must account for
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.8"))
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 1000
+
+EPOCH = date(1970, 1, 1)
+
+# --- Vocabulary ---
+# Metric phrases, longest first so "ad sales" wins over "sales"
+METRIC_PHRASES = [
+    (r"click through rates?|ctr", "ctr"),
+    (r"cost per clicks?|cpc", "cpc"),
+    (r"return on ad spend|roas", "roas"),
+    (r"ad sales|advertising sales|ad revenue", "ad_sales"),
+    (r"ad spend|advertising spend|ad cost|spend", "ad_spend"),
+    (r"units sold", "units_sold"),
+    (r"units ordered|ordered units|units|orders", "total_units_ordered"),
+    (r"sales|revenue", "total_sales"),
+    (r"clicks", "clicks"),
+    (r"impressions|views", "impressions"),
+]
+
+# Source table and aggregate of each metric when the rollups can't be used
+METRICS = {
+    "total_sales": ("total_sales_metrics", "SUM(total_sales)"),
+    "total_units_ordered": ("total_sales_metrics", "SUM(total_units_ordered)"),
+    "ad_sales": ("ad_sales_metrics", "SUM(ad_sales)"),
+    "ad_spend": ("ad_sales_metrics", "SUM(ad_spend)"),
+    "clicks": ("ad_sales_metrics", "SUM(clicks)"),
+    "impressions": ("ad_sales_metrics", "SUM(impressions)"),
+    "units_sold": ("ad_sales_metrics", "SUM(units_sold)"),
+    "ctr": ("ad_sales_metrics", "ROUND(1.0 * SUM(clicks) / NULLIF(SUM(impressions), 0), 6)"),
+    "cpc": ("ad_sales_metrics", "ROUND(SUM(ad_spend) / NULLIF(SUM(clicks), 0), 4)"),
+    "roas": ("ad_sales_metrics", "ROUND(SUM(ad_sales) / NULLIF(SUM(ad_spend), 0), 4)"),
+}
+
+SERIES_WORDS = r"trends?|over time|by date|by day|daily|per day|each day|day by day|time series|timeline"
+RANK_WORDS = r"top|highest|best|most|largest|biggest|lowest|least|worst|bottom|smallest|rank|ranking"
+ASCENDING_WORDS = {"lowest", "least", "worst", "bottom", "smallest"}
+ITEM_WORDS = r"items?|products?|skus?"
+TOTAL_WORDS = r"total|sum|overall|how much|how many"
+
+# Words that carry no meaning for the templates. Time words ("daily", "date", "each") are
+# not filler: they ask for a series, and a template that ignores them must lose confidence.
+FILLER = set("""
+a all an and are as at by can compare chart display do does for from get give graph
+had has have how i in is it its list me my of on or our over per please plot show tell the their them this
+to total value values versus vs was were what which with you
+""".split())
+
+# Negations flip what a template would answer ("sales excluding item 29"), so they always go to the model
+NEGATION_WORDS = r"not|no|non|never|without|except|excluding|exclude|excludes|other than|apart from|ignoring|\w+n t"
+
+_ITEM_ID_RE = re.compile(r"\bitem(?: ?id)?\s*#?\s*(\d+)\b")
+# "top 5" / "worst 5" / "5 items"; the keyword gives the sort direction, the item word is left for the ranking template
+_TOP_N_RE = re.compile(rf"\b({RANK_WORDS}|first)\s+(\d+)\b|\b(\d+)(?=\s+(?:{ITEM_WORDS})\b)")
+_NEGATION_RE = re.compile(rf"\b(?:{NEGATION_WORDS})\b")
+_SERIES_RE = re.compile(rf"\b(?:{SERIES_WORDS})\b")
+_BETWEEN_RE = re.compile(r"\b(?:between|from)\s+(\d{4}-\d{2}-\d{2})\s+(?:and|to|until)\s+(\d{4}-\d{2}-\d{2})\b")
+_SINCE_RE = re.compile(r"\b(?:since|after)\s+(\d{4}-\d{2}-\d{2})\b")
+_LAST_RE = re.compile(r"\b(?:in\s+)?(?:the\s+)?(?:last|past|previous)\s+(\d+\s+)?(day|week|month)s?\b")
+
+_lock = threading.Lock()
+_schemas = {}
+_stats = {"matched": 0, "fallbacks": 0, "low_confidence": 0, "negated": 0}
+
+
+# --- Schema ---
+def _schema(db_path: str) -> dict:
+    """
+    {table: {column: declared_type}} for the current schema, cached per fingerprint.
+    """
+    fingerprint = schema_fingerprint(db_path)
+    cached = _schemas.get(db_path)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    with connection(db_path) as conn:
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        schema = {name: {col[1]: (col[2] or "").upper() for col in conn.execute(f'PRAGMA table_info("{name}")')}
+                  for name in names}
+    with _lock:
+        _schemas[db_path] = (fingerprint, schema)
+    return schema
+
+
+# --- Slot extraction ---
+def _normalize(question: str) -> str:
+    text = question.lower()
+    text = re.sub(r"(?<=[a-z])-(?=[a-z])", " ", text)  # click-through -> click through
+    text = re.sub(r"[^a-z0-9\-#]+", " ", text)
+    return " ".join(text.split())
+
+
+class _Slots:
+    """
+    Pulls slots out of the normalized question and blanks out every matched span,
+    so the words left over show how much of the question the template explains.
+    """
+
+    def __init__(self, question: str):
+        self.text = _normalize(question)
+        self.total_words = len([w for w in self.text.split() if w not in FILLER]) or 1
+        self._rest = f" {self.text} "
+
+    def take(self, pattern) -> list:
+        pattern = pattern if isinstance(pattern, re.Pattern) else re.compile(rf"\b(?:{pattern})\b")
+        matches = list(pattern.finditer(self._rest))
+        for m in matches:
+            self._rest = self._rest[:m.start()] + " " * (m.end() - m.start()) + self._rest[m.end():]
+        return matches
+
+    def confidence(self) -> float:
+        left = [w for w in self._rest.split() if w not in FILLER]
+        return 1 - len(left) / self.total_words
+
+
+def _extract(question: str) -> tuple[_Slots, dict]:
+    slots = _Slots(question)
+    found = {"metrics": [], "item_id": None, "top_n": None, "ascending": False, "range": None}
+
+    for m in slots.take(_ITEM_ID_RE):
+        found["item_id"] = int(m.group(1))
+    for m in slots.take(_TOP_N_RE):
+        found["top_n"] = min(int(m.group(2) or m.group(3)), MAX_TOP_N)
+        found["ascending"] = m.group(1) in ASCENDING_WORDS
+
+    for m in slots.take(_BETWEEN_RE):
+        found["range"] = ("between", m.group(1), m.group(2))
+    for m in slots.take(_SINCE_RE):
+        found["range"] = ("since", m.group(1))
+    for m in slots.take(_LAST_RE):
+        count = int(m.group(1)) if m.group(1) else 1
+        found["range"] = ("last", count * {"day": 1, "week": 7, "month": 30}[m.group(2)])
+
+    # Metrics keep the order they are mentioned in ("ad sales vs ad spend")
+    mentioned = sorted((m.start(), column) for phrase, column in METRIC_PHRASES for m in slots.take(phrase))
+    for _, column in mentioned:
+        if column not in found["metrics"]:
+            found["metrics"].append(column)
+    return slots, found
+
+
+# --- SQL building ---
+def _is_epoch(schema: dict, table: str) -> bool:
+    return "INT" in schema[table].get("date", "")
+
+
+def _date_select(schema: dict, table: str) -> str:
+    return "date(date * 86400, 'unixepoch') AS date" if _is_epoch(schema, table) else "date(date) AS date"
+
+
+def _range_clause(schema: dict, table: str, date_range) -> tuple[list, list]:
+    if date_range is None:
+        return [], []
+    epoch = _is_epoch(schema, table)
+    if date_range[0] == "last":
+        # Relative to the newest data, not today: the tables hold historical snapshots
+        if epoch:
+            return [f"date > (SELECT MAX(date) FROM {table}) - ?"], [date_range[1]]
+        return [f"date > date((SELECT MAX(date) FROM {table}), '-' || ? || ' days')"], [date_range[1]]
+
+    days = [date.fromisoformat(d) for d in date_range[1:]]
+    values = [(d - EPOCH).days for d in days] if epoch else [d.isoformat() for d in days]
+    if date_range[0] == "since":
+        return ["date >= ?"], values
+    if epoch:
+        return ["date BETWEEN ? AND ?"], values
+    return ["date >= ? AND date < date(?, '+1 day')"], values
+
+
+def _base_table(schema: dict, metrics: list):
+    # Without a rollup, every metric has to come from the same table
+    tables = {METRICS[m][0] for m in metrics}
+    if len(tables) != 1:
+        return None
+    table = tables.pop()
+    return table if table in schema else None
+
+
+def _where(clauses: list) -> str:
+    return f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+def series_sql(schema: dict, found: dict):
+    metrics, item_id, date_range = found["metrics"], found["item_id"], found["range"]
+    rollup = "daily_sales_rollup"
+    if item_id is None and rollup in schema and all(m in schema[rollup] for m in metrics):
+        clauses, params = _range_clause(schema, rollup, date_range)
+        return (f"SELECT {_date_select(schema, rollup)}, {', '.join(metrics)} FROM {rollup}"
+                f"{_where(clauses)} ORDER BY 1", params)
+
+    table = _base_table(schema, metrics)
+    if table is None:
+        return None
+    clauses, params = _range_clause(schema, table, date_range)
+    if item_id is not None:
+        clauses.insert(0, "item_id = ?")
+        params.insert(0, item_id)
+    columns = ", ".join(f"{METRICS[m][1]} AS {m}" for m in metrics)
+    return f"SELECT {_date_select(schema, table)}, {columns} FROM {table}{_where(clauses)} GROUP BY 1 ORDER BY 1", params
+
+
+def ranking_sql(schema: dict, found: dict, ascending: bool):
+    metric, date_range = found["metrics"][0], found["range"]
+    limit = found["top_n"] or DEFAULT_TOP_N
+    order = "ASC" if ascending else "DESC"
+    rollup = "item_sales_rollup"
+    if date_range is None and rollup in schema and metric in schema[rollup]:
+        return (f"SELECT item_id, {metric} FROM {rollup} WHERE {metric} IS NOT NULL "
+                f"ORDER BY {metric} {order} LIMIT ?", [limit])
+
+    table = _base_table(schema, [metric])
+    if table is None:
+        return None
+    clauses, params = _range_clause(schema, table, date_range)
+    expression = METRICS[metric][1]
+    return (f"SELECT item_id, {expression} AS {metric} FROM {table}{_where(clauses)} GROUP BY item_id "
+            f"HAVING {expression} IS NOT NULL ORDER BY 2 {order} LIMIT ?", params + [limit])
+
+
+def total_sql(schema: dict, found: dict):
+    metrics, item_id = found["metrics"], found["item_id"]
+    table = _base_table(schema, metrics)
+    if table is None:
+        return None
+    clauses, params = _range_clause(schema, table, found["range"])
+    if item_id is not None:
+        clauses.insert(0, "item_id = ?")
+        params.insert(0, item_id)
+    columns = ", ".join(f"{METRICS[m][1]} AS {m}" for m in metrics)
+    return f"SELECT {columns} FROM {table}{_where(clauses)}", params
+
+
+# --- Registry ---
+# (name, builder) in priority order; each builder claims its keywords from the slots
+# and returns (sql, params), or None when the question isn't of its kind. A builder
+# also returns None when a slot it can't express was found ("sales trend of the top 5
+# items" is neither an all-items series nor a plain ranking), since extracted slots
+# already count toward the confidence.
+def _series(slots, found, schema):
+    if found["top_n"] is not None or not slots.take(SERIES_WORDS) or not found["metrics"]:
+        return None
+    return series_sql(schema, found)
+
+
+def _ranking(slots, found, schema):
+    if _SERIES_RE.search(slots.text):
+        return None  # per-day values of the top items
+    rank = slots.take(RANK_WORDS)
+    items = slots.take(ITEM_WORDS)
+    if not (rank or found["top_n"]) or not items or len(found["metrics"]) != 1 \
+            or found["item_id"] is not None:
+        return None
+    if found["top_n"] is None and not any(m.group().endswith("s") for m in items):
+        found["top_n"] = 1  # "which item has the highest sales"
+    ascending = found["ascending"] or any(m.group() in ASCENDING_WORDS for m in rank)
+    return ranking_sql(schema, found, ascending)
+
+
+def _total(slots, found, schema):
+    if found["top_n"] is not None or not slots.take(TOTAL_WORDS) or not found["metrics"]:
+        return None
+    return total_sql(schema, found)
+
+
+TEMPLATES = [("series", _series), ("ranking", _ranking), ("total", _total)]
+
+
+def match_intent(question: str, db_path: str):
+    """
+    Returns (sql, params, intent_name) when a template explains at least
+    INTENT_MIN_CONFIDENCE of the question, otherwise None so the caller asks the model.
+    """
+    if not INTENTS_ENABLED or not question:
+        return None
+    if _NEGATION_RE.search(_normalize(question)):
+        with _lock:
+            _stats["negated"] += 1
+            _stats["fallbacks"] += 1
+        return None
+
+    with span("intent_match"):
+        try:
+            schema = _schema(db_path)
+        except Exception as e:
+            print(f"ℹ Intent matching skipped, schema unavailable: {e}")
+            return None
+
+        for name, builder in TEMPLATES:
+            slots, found = _extract(question)
+            try:
+                built = builder(slots, found, schema)
+            except ValueError:
+                built = None  # e.g. an impossible date
+            if built is None:
+                continue
+
+            confidence = slots.confidence()
+            if confidence < INTENT_MIN_CONFIDENCE:
+                with _lock:
+                    _stats["low_confidence"] += 1
+                continue
+
+            sql_query, params = built
+            with _lock:
+                _stats["matched"] += 1
+            annotate(sql=sql_query, sql_source="intent", intent=name, intent_confidence=round(confidence, 3))
+            return sql_query, tuple(params), name
+
+    with _lock:
+        _stats["fallbacks"] += 1
+    return None
+
+
+def intent_stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+# --- Self-check ---
+# (question, expected intent or None, text the SQL must contain[, expected params])
+CHECKS = [
+    ("Plot top 5 items by impressions", "ranking", " DESC "),
+    ("worst 5 items by ctr", "ranking", " ASC "),
+    ("bottom 10 items by sales", "ranking", " ASC "),
+    ("lowest 3 products by clicks", "ranking", " ASC "),
+    ("Show total sales trend over time", "series", None),
+    ("Show sales trend in the last 7 days", "series", "?"),
+    ("Show sales trend excluding item 29", None, None),
+    ("Show sales trend without item 29", None, None),
+    ("Total sales except item 29", None, None),
+    ("top 5 items by clicks other than item 3", None, None),
+    ("Which item has the highest sales?", "ranking", " DESC ", (1,)),
+    ("sales trend for the top 5 items", None, None),
+    ("clicks over time for the worst 3 items", None, None),
+    ("top 5 items by sales per day", None, None),
+    ("Show daily sales of the top 10 products", None, None),
+]
+
+
+def self_check(db_path: str) -> list:
+    """
+    Runs CHECKS against db_path and returns the failures as (question, problem) pairs.
+    """
+    failures = []
+    for question, expected, fragment, *params in CHECKS:
+        matched = match_intent(question, db_path)
+        name = matched[2] if matched else None
+        if name != expected:
+            failures.append((question, f"matched {name}, expected {expected}"))
+        elif matched and fragment and fragment not in matched[0]:
+            failures.append((question, f"SQL lacks {fragment.strip()!r}: {matched[0]}"))
+        elif matched and params and matched[1] != params[0]:
+            failures.append((question, f"params {matched[1]}, expected {params[0]}"))
+    return failures
+
+
+# ------------------------- #
+# python -m app.intents [db_path]
+# ------------------------- #
+if __name__ == "__main__":
+    import sys
+    failed = self_check(sys.argv[1] if len(sys.argv) > 1 else "database/ecommerce.db")
+    for question, problem in failed:
+        print(f"❌ {question}: {problem}")
+    print("✅ All intent checks passed" if not failed else f"❌ {len(failed)} of {len(CHECKS)} intent checks failed")
+    sys.exit(1 if failed else 0)
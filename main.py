@@ -1,34 +1,183 @@
-from flask import Flask, request, jsonify
-from app.query_engine import run_query
+from flask import Flask, Response, request, jsonify, stream_with_context
+from app.query_engine import run_query, stream_query, fetch_page, run_batch, chart_series
+from app.encoding import JSON_MIME, negotiate, encode_result, compress
+from app._gemini_connector import warm_up, is_warm
+from app.db_pool import health_check, pool_stats
+from app.metrics import trace, traced_stream, span, annotate, register_gauges, pipeline_gauges, render_prometheus
+import os
+import json
+import sqlite3
+import threading
 import traceback
 
+DB_PATH = os.getenv("ECOMMERCE_DB_PATH", "database/ecommerce.db")
+
 app = Flask(__name__)
+register_gauges(pipeline_gauges)
+
+# Load the Gemini SDK and introspect the schema in the background so the server is
+# ready to accept requests immediately; /health reports when warm-up has finished
+if os.getenv("WARM_UP_ON_START", "1") == "1":
+    threading.Thread(target=warm_up, args=(DB_PATH,), daemon=True).start()
 
 @app.route("/ask", methods=["POST"])
 def ask_question():
     try:
         data = request.json
         question = data.get("question")
+        page_token = data.get("page_token")
 
-        if not question:
+        if not question and not page_token:
             return jsonify({"error": "No question provided"}), 400
 
-        # Run the Gemini → SQL → SQLite pipeline
-        results = run_query(question)
+        # Optional {"item_id": "29", "message": "cost"}, applied in SQL
+        filters = data.get("filters") or {}
+        if not isinstance(filters, dict):
+            return jsonify({"error": "filters must be an object"}), 400
+
+        # Arrow IPC or MessagePack when the Accept header asks for it: one page, encoded by column
+        mime = negotiate(request.headers.get("Accept"))
+        if mime != JSON_MIME:
+            return binary_answer(mime, question, page_token, data.get("limit"), filters)
+
+        # Stream rows as NDJSON when asked, one page of `limit` rows at a time
+        if data.get("stream") or request.args.get("stream") == "1":
+            lines = stream_query(question, DB_PATH, page_token=page_token, limit=data.get("limit"),
+                                 filters=filters)
+            return Response(stream_with_context(traced_stream(lines, question)), mimetype="application/x-ndjson")
+
+        # A page token in plain JSON mode returns that page with the rows under "results"
+        if page_token:
+            return json_page(question, page_token, data.get("limit"), filters)
 
-        # Check if error occurred during SQL execution
-        if isinstance(results, dict) and "error" in results:
-            return jsonify({"error": results["error"]}), 500
+        with trace(question):
+            # Run the Gemini → SQL → SQLite pipeline
+            results = run_query(question, DB_PATH, filters)
 
-        return jsonify({
-            "question": question,
-            "results": results
-        })
+            # Check if error occurred during SQL execution
+            if isinstance(results, dict) and "error" in results:
+                return jsonify({"error": results["error"]}), 500
+
+            with span("json_serialize"):
+                body = json.dumps({
+                    "question": question,
+                    "results": results
+                }, default=str)
+            body, encoding = compress(body.encode("utf-8"), request.headers.get("Accept-Encoding"))
+            annotate(rows=len(results), bytes=len(body))
+
+        return encoded_response(body, JSON_MIME, encoding)
 
     except Exception as e:
         print("❌ Exception in /ask endpoint:", e)
         traceback.print_exc()
         return jsonify({"error": "Internal Server Error"}), 500
 
+def encoded_response(body: bytes, mime: str, encoding: str = None) -> Response:
+    response = Response(body, mimetype=mime)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response
+
+def binary_answer(mime, question, page_token, limit, filters):
+    with trace(question):
+        try:
+            page = fetch_page(question, DB_PATH, page_token=page_token, limit=limit, filters=filters)
+        except (ValueError, sqlite3.Error) as e:
+            # Errors stay JSON so every client can read them
+            return jsonify({"error": str(e)}), 400
+
+        metadata = {k: page[k] for k in ("question", "sql_query", "filters", "truncated", "next_page_token",
+                                         "answer_token")}
+        with span("binary_serialize"):
+            body = encode_result(mime, page["columns"], page["rows"], metadata)
+        body, encoding = compress(body, request.headers.get("Accept-Encoding"))
+        annotate(rows=len(page["rows"]), bytes=len(body), format=mime)
+    return encoded_response(body, mime, encoding)
+
+def json_page(question, page_token, limit, filters):
+    with trace(question):
+        try:
+            page = fetch_page(question, DB_PATH, page_token=page_token, limit=limit, filters=filters)
+        except (ValueError, sqlite3.Error) as e:
+            return jsonify({"error": str(e)}), 400
+
+        with span("json_serialize"):
+            body = json.dumps({"question": question, "sql_query": page["sql_query"], "results": page["rows"],
+                               "filters": page["filters"], "truncated": page["truncated"],
+                               "next_page_token": page["next_page_token"]}, default=str)
+        body, encoding = compress(body.encode("utf-8"), request.headers.get("Accept-Encoding"))
+        annotate(rows=len(page["rows"]), bytes=len(body))
+    return encoded_response(body, JSON_MIME, encoding)
+
+@app.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    try:
+        data = request.json
+        questions = data.get("questions")
+
+        if not questions or not isinstance(questions, list) or not all(isinstance(q, str) and q for q in questions):
+            return jsonify({"error": "Provide a non-empty list of questions"}), 400
+
+        with trace("; ".join(questions), endpoint="/ask/batch"):
+            try:
+                answers = run_batch(questions, DB_PATH)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            with span("json_serialize"):
+                body = json.dumps({"results": answers}, default=str)
+            annotate(rows=sum(len(a.get("results", [])) for a in answers), bytes=len(body))
+
+        return Response(body, mimetype="application/json")
+
+    except Exception as e:
+        print("❌ Exception in /ask/batch endpoint:", e)
+        traceback.print_exc()
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route("/ask/chart", methods=["POST"])
+def ask_chart():
+    try:
+        data = request.json
+        question, x, y = data.get("question"), data.get("x"), data.get("y")
+        # answer_token from /ask charts the SQL behind that answer instead of generating it again
+        answer_token = data.get("answer_token")
+        filters = data.get("filters") or {}
+
+        if not (question or answer_token) or not x or not y:
+            return jsonify({"error": "question or answer_token, x and y are required"}), 400
+        if not isinstance(filters, dict):
+            return jsonify({"error": "filters must be an object"}), 400
+
+        with trace(question, endpoint="/ask/chart"):
+            try:
+                series = chart_series(question, x, y, agg=data.get("agg"), max_points=data.get("points"),
+                                      db_path=DB_PATH, filters=filters, answer_token=answer_token)
+            except (ValueError, sqlite3.Error) as e:
+                return jsonify({"error": str(e)}), 400
+
+            with span("json_serialize"):
+                body = json.dumps(series, default=str)
+            annotate(rows=len(series["points"]), bytes=len(body))
+
+        return Response(body, mimetype="application/json")
+
+    except Exception as e:
+        print("❌ Exception in /ask/chart endpoint:", e)
+        traceback.print_exc()
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route("/health", methods=["GET"])
+def health():
+    pools = health_check()
+    status = 200 if all(pools.values()) else 503
+    return jsonify({"healthy": status == 200, "warm": is_warm(), "pools": pools, "stats": pool_stats()}), status
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(debug=True)
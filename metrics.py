@@ -0,0 +1,205 @@
+# app/metrics.py
+
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Per-stage latency histograms for the ask pipeline, exposed in Prometheus text format.
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "2"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", os.path.join("logs", "requests.jsonl"))
+
+# HDR-style log-linear buckets: 4 per power of two from 100µs to ~2 minutes (≤19% relative error)
+BUCKETS = [round(0.0001 * 2 ** (i / 4), 7) for i in range(81)]
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {"ask_requests_total": 0, "ask_rows_returned_total": 0, "ask_response_bytes_total": 0,
+             "ask_slow_requests_total": 0}
+_gauge_sources = []
+_current = contextvars.ContextVar("ask_trace", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        low, high = 0, len(BUCKETS)
+        while low < high:
+            mid = (low + high) // 2
+            if value <= BUCKETS[mid]:
+                high = mid
+            else:
+                low = mid + 1
+        self.counts[low] += 1
+        self.total += value
+        self.count += 1
+
+
+def observe(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+# --- Tracing ---
+@contextmanager
+def span(stage: str):
+    """
+    Times one pipeline stage into ask_stage_seconds{stage=...} and the current request trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("ask_stage_seconds", elapsed, stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace["spans"][stage] = round(trace["spans"].get(stage, 0.0) + elapsed, 6)
+
+
+def annotate(**fields):
+    """
+    Attaches fields (sql, rows, bytes, ...) to the current request trace.
+    rows and bytes are also added to the pipeline counters.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.update(fields)
+
+
+@contextmanager
+def trace(question: str, endpoint: str = "/ask"):
+    """
+    Wraps one request: records total latency, rows and bytes, and appends a sampled
+    entry to the slow query log when the request takes longer than SLOW_QUERY_SECONDS.
+    """
+    record = {"question": question, "endpoint": endpoint, "spans": {}}
+    token = _current.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - start
+        observe("ask_request_seconds", elapsed, endpoint=endpoint)
+        slow = elapsed >= SLOW_QUERY_SECONDS
+        with _lock:
+            _counters["ask_requests_total"] += 1
+            _counters["ask_rows_returned_total"] += record.get("rows", 0)
+            _counters["ask_response_bytes_total"] += record.get("bytes", 0)
+            if slow:
+                _counters["ask_slow_requests_total"] += 1
+        if slow and random.random() < SLOW_QUERY_SAMPLE_RATE:
+            _log_slow(record, elapsed)
+
+
+def _log_slow(record: dict, elapsed: float):
+    entry = {"ts": time.time(), "seconds": round(elapsed, 6), **record}
+    folder = os.path.dirname(SLOW_QUERY_LOG)
+    with _lock:
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+
+
+def traced_stream(lines, question: str, endpoint: str = "/ask"):
+    """
+    Wraps an NDJSON line generator so the whole stream is one trace,
+    counting the rows and bytes actually sent.
+    """
+    with trace(question, endpoint) as record:
+        rows = sent = 0
+        for line in lines:
+            sent += len(line)
+            if line.startswith("["):
+                rows += 1
+            yield line
+        record.update(rows=rows, bytes=sent)
+
+
+# --- Exposition ---
+def register_gauges(source):
+    """
+    Registers a callable returning {metric_name: value}; it is read on every scrape.
+    """
+    _gauge_sources.append(source)
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        histograms = {k: (list(h.counts), h.total, h.count) for k, h in _histograms.items()}
+        counters = dict(_counters)
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ["+Inf"], counts):
+                cumulative += bucket
+                le = f'le="{bound:g}"' if bound != "+Inf" else 'le="+Inf"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+
+    typed = set()
+    for source in _gauge_sources:
+        try:
+            gauges = source()
+        except Exception:
+            continue
+        for name, value in sorted(gauges.items()):
+            base = name.split("{", 1)[0]
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {base} gauge")
+            lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def pipeline_gauges() -> dict:
+    """
+    Cache, intent, SQL repair and connection pool counters, for register_gauges().
+    """
+    from app.sql_cache import cache_stats
+    from app.result_cache import result_cache_stats
+    from app.sql_repair import repair_stats
+    from app.intents import intent_stats
+    from app.db_pool import pool_stats
+
+    gauges = {f"sql_cache_{k}": v for k, v in cache_stats().items()}
+    gauges.update({f"result_cache_{k}": v for k, v in result_cache_stats().items()})
+    gauges.update({f"sql_repair_{k}": v for k, v in repair_stats().items()})
+    gauges.update({f"intent_{k}": v for k, v in intent_stats().items()})
+    for name, stats in pool_stats().items():
+        label = '{pool="%s"}' % name
+        for key in ("checkouts", "wait_seconds", "max_wait_seconds", "timeouts", "open", "idle"):
+            gauges[f"db_pool_{key}{label}"] = stats[key]
+    return gauges
@@ -1,43 +1,485 @@
-import sqlite3
-from app._gemini_connector import ask_gemini
+import os
+import re
+import hmac
+import json
+import base64
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from app._gemini_connector import ask_gemini, ask_gemini_batch
+from app.sql_cache import get_cached_sql, store_sql, schema_fingerprint, normalize_question
+from app.result_cache import get_cached_result, store_result
+from app.db_pool import connection, POOL_SIZE
+from app.columnar import can_use_columnar, execute_columnar
+from app.sql_guard import guard_sql, query_budget
+from app.sql_repair import (REPAIR_MAX_ATTEMPTS, validate_sql, past_failures, record_failure, forget_failures,
+                            record_outcome)
+from app.metrics import span, annotate
+from app.inspect_db import MESSAGE_FTS_TABLE
+from app.intents import match_intent
+from app.visualizer import (AGGREGATES, BUCKET_SQL, epoch_day_sql, choose_bucket, default_aggregate,
+                            lttb, to_iso)
 
-def run_query(question: str, db_path="database/ecommerce.db") -> list[tuple]:
+# --- Streaming limits ---
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+STREAM_DEFAULT_LIMIT = int(os.getenv("STREAM_DEFAULT_LIMIT", "1000"))
+STREAM_MAX_ROWS = int(os.getenv("STREAM_MAX_ROWS", "50000"))
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# --- Batch limits ---
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "25"))
+# Queries of one batch run side by side on this many pooled connections
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(POOL_SIZE)))
+
+# --- Chart limits ---
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "500"))
+
+# Page tokens carry the SQL, so they are signed to stop clients from sending their own.
+# Every worker process must share the secret, or tokens fail on the workers that didn't issue them.
+PAGE_TOKEN_SECRET = (os.getenv("PAGE_TOKEN_SECRET") or os.urandom(16).hex()).encode("utf-8")
+if not os.getenv("PAGE_TOKEN_SECRET"):
+    print("⚠ PAGE_TOKEN_SECRET is not set; page and answer tokens only work on the process that issued them")
+
+
+def generate_sql(question: str, db_path="database/ecommerce.db") -> tuple[str, tuple, str]:
+    """
+    Returns (sql, params, source) for a question. Common questions are answered by the
+    intent templates with parameterized SQL ("intent"), then cached SQL is reused ("cache"),
+    and only then is Gemini asked for SQL that passes validation ("gemini", see generate_valid_sql).
+    Raises ValueError when no usable SQL comes back.
+    """
+    # Step 1: Template match, then cached SQL, otherwise ask Gemini
+    matched = match_intent(question, db_path)
+    if matched is not None:
+        sql_query, params, _ = matched
+        return sql_query, params, "intent"
+
+    sql_query = get_cached_sql(question, db_path)
+    if sql_query is not None:
+        annotate(sql=sql_query, sql_source="cache")
+        return sql_query, (), "cache"
+
+    return generate_valid_sql(question, db_path), (), "gemini"
+
+
+def generate_valid_sql(question: str, db_path="database/ecommerce.db", candidate: str = None) -> str:
+    """
+    Asks Gemini for SQL and checks it with EXPLAIN on a read-only connection before it runs.
+    When the check fails, the SQLite error goes back to the model for at most
+    REPAIR_MAX_ATTEMPTS repairs. Mistakes already made for the question (e.g. before the
+    user retried) are part of the first prompt. candidate is SQL already proposed for the
+    question, such as a batch answer, and is checked before any model call.
+    Raises ValueError with the last error when every attempt fails.
+    """
+    failures = past_failures(question, db_path)
+    error = None
+    for attempt in range(REPAIR_MAX_ATTEMPTS + 1):
+        try:
+            if attempt == 0 and candidate is not None:
+                sql_query = clean_sql(candidate)
+            else:
+                sql_query = clean_sql(ask_gemini(question, db_path, failures))
+        except ValueError as e:
+            # Not a SELECT at all; there is no SQL to show the model, so just ask again
+            error = str(e)
+            continue
+
+        error = validate_sql(sql_query, db_path)
+        if error is None:
+            record_outcome(attempt, True)
+            forget_failures(question, db_path)
+            annotate(sql=sql_query, sql_source="gemini")
+            return sql_query
+
+        print(f"ℹ Generated SQL failed validation (attempt {attempt + 1}): {error}")
+        failures = record_failure(question, sql_query, error, db_path)
+
+    record_outcome(REPAIR_MAX_ATTEMPTS, False)
+    raise ValueError(f"No valid SQL after {REPAIR_MAX_ATTEMPTS} repairs: {error}")
+
+
+def clean_sql(sql_query: str) -> str:
+    with span("sql_cleanup"):
+        return _clean_sql(sql_query)
+
+
+def _clean_sql(sql_query: str) -> str:
+    # Step 2: Clean up SQL from markdown formatting
+    if not sql_query:
+        raise ValueError("Empty SQL returned from Gemini")
+
+    # Remove code block if it exists
+    if "```" in sql_query:
+        parts = sql_query.split("```")
+        if len(parts) >= 2:
+            sql_query = parts[1].replace("sql", "").strip()
+        else:
+            raise ValueError("Unable to parse SQL block")
+
+    sql_query = sql_query.strip()
+
+    if not sql_query:
+        raise ValueError("Final SQL is empty after cleaning")
+
+    return sql_query
+
+
+def remember_sql(question: str, sql_query: str, db_path: str):
+    # Called once the SQL executed cleanly, so only working SQL is cached
+    store_sql(question, sql_query, db_path)
+
+
+# --- Filters ---
+def apply_filters(sql_query: str, filters: dict, db_path="database/ecommerce.db",
+                  params: tuple = ()) -> tuple[str, tuple, dict]:
+    """
+    Wraps the SQL in a parameterized outer WHERE for the /ask filters:
+    item_id matches one or more ids ("29" or "29, 31"), and message matches words through
+    the FTS5 index db_loader builds (falling back to LIKE when the index is missing).
+    Filters on columns the result doesn't have are skipped. params are the values already
+    bound to sql_query's placeholders; the filter values are appended to them.
+    Returns (sql, params, applied_filters). Raises ValueError for malformed filters.
+    """
+    base_params = tuple(params)
+    filters = {k: str(v).strip() for k, v in (filters or {}).items() if v is not None and str(v).strip()}
+    if not filters:
+        return sql_query, base_params, {}
+
+    with connection(db_path) as conn:
+        with span("sql_guard"):
+            inner = guard_sql(conn, sql_query, inject_limit=False, params=base_params)
+        columns = [col[0] for col in conn.execute(f"SELECT * FROM ({inner}) LIMIT 0", base_params).description]
+        has_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (MESSAGE_FTS_TABLE,)
+        ).fetchone() is not None
+
+    clauses, params, applied = [], [], {}
+    if "item_id" in filters and "item_id" in columns:
+        ids = [v for v in re.split(r"[,\s]+", filters["item_id"]) if v]
+        if not all(v.isdigit() for v in ids):
+            raise ValueError("The item_id filter takes numeric ids, e.g. 29 or 29, 31")
+        clauses.append(f'"item_id" IN ({", ".join("?" for _ in ids)})')
+        params += [int(v) for v in ids]
+        applied["item_id"] = filters["item_id"]
+
+    if "message" in filters and "message" in columns:
+        words = re.findall(r"\w+", filters["message"])
+        if has_fts and words:
+            # Each word is a quoted prefix term, so user input can't inject FTS syntax
+            clauses.append(f'"message" IN (SELECT message FROM {MESSAGE_FTS_TABLE} WHERE {MESSAGE_FTS_TABLE} MATCH ?)')
+            params.append(" ".join(f'"{w}"*' for w in words))
+        else:
+            clauses.append('"message" LIKE ? ESCAPE \'!\'')
+            params.append("%" + re.sub(r"([%_!])", r"!\1", filters["message"]) + "%")
+        applied["message"] = filters["message"]
+
+    if not clauses:
+        return sql_query, base_params, {}
+    return f"SELECT * FROM ({inner}) WHERE {' AND '.join(clauses)}", base_params + tuple(params), applied
+
+
+def execute_sql(sql_query: str, db_path="database/ecommerce.db", params: tuple = ()) -> tuple[list, list]:
+    """
+    Step 3: Serves repeated SQL from the result cache. Otherwise the SQL passes the guard
+    (cartesian join check, LIMIT injection) and runs on the columnar engine when enabled
+    for heavy aggregations, or on a pooled read-only connection under a time and VM-step
+    budget. params are bound to the SQL's placeholders.
+    Returns (column_names, rows). Raises QueryRejected for rejected plans.
+    """
+    cached = get_cached_result(sql_query, db_path, params)
+    if cached is not None:
+        return cached
+
+    with connection(db_path) as conn:
+        with span("sql_guard"):
+            guarded_sql = guard_sql(conn, sql_query, params=params)
+
+        if not params and can_use_columnar(guarded_sql, db_path):
+            try:
+                columns, results = execute_columnar(guarded_sql, conn)
+                store_result(sql_query, db_path, columns, results)
+                return columns, results
+            except Exception as e:
+                print(f"ℹ Columnar engine failed, falling back to SQLite: {e}")
+
+        with query_budget(conn, guarded_sql):
+            with span("sqlite_execute"):
+                cursor = conn.execute(guarded_sql, params)
+            with span("sqlite_fetch"):
+                results = cursor.fetchall()
+        columns = [col[0] for col in cursor.description or []]
+    store_result(sql_query, db_path, columns, results, params)
+    return columns, results
+
+
+def run_query(question: str, db_path="database/ecommerce.db", filters: dict = None) -> list[tuple]:
     """
     Converts a natural language question to SQL using Gemini,
     executes the SQL on the ecommerce.db SQLite database.
+    Previously generated SQL is reused from the question cache and
+    results of identical SQL on the same data version from the result cache.
+    filters ({"item_id": ..., "message": ...}) are applied in SQL, see apply_filters.
     Returns results as a list of tuples.
     """
     try:
-        # Step 1: Get SQL from Gemini
-        sql_query = ask_gemini(question)
-        print(f"Raw SQL from Gemini:\n{sql_query}\n")
-
-        # Step 2: Clean up SQL from markdown formatting
-        if not sql_query:
-            return [("Error:", "Empty SQL returned from Gemini")]
-
-        # Remove code block if it exists
-        if "```" in sql_query:
-            parts = sql_query.split("```")
-            if len(parts) >= 2:
-                sql_query = parts[1].replace("sql", "").strip()
-            else:
-                return [("Error:", "Unable to parse SQL block")]
-
-        sql_query = sql_query.strip()
-        print(f"Cleaned SQL:\n{sql_query}\n")
+        sql_query, params, source = generate_sql(question, db_path)
+        filtered_sql, params, _ = apply_filters(sql_query, filters, db_path, params)
+        _, results = execute_sql(filtered_sql, db_path, params)
 
-        if not sql_query:
-            return [("Error:", "Final SQL is empty after cleaning")]
-
-        # Step 3: Run SQL on SQLite DB
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
-        conn.close()
+        if source == "gemini":
+            remember_sql(question, sql_query, db_path)
 
         return results if results else [("Notice:", "Query executed but returned no results.")]
 
     except Exception as e:
         return [("Error:", str(e))]
+
+
+# --- Batches ---
+def run_batch(questions: list, db_path="database/ecommerce.db") -> list[dict]:
+    """
+    Answers several questions at once: intent templates and cached SQL are used first,
+    the remaining questions go to Gemini in a single batch prompt, and the queries run concurrently on pooled
+    read-only connections. Batch answers are validated like single ones; missing or
+    invalid answers are asked for (and repaired) one by one. Duplicate questions are answered once.
+    Returns one {"question", "sql_query", "results"} or {"question", "error"} per question.
+    Raises ValueError when more than BATCH_MAX_QUESTIONS are sent.
+    """
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise ValueError(f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+
+    unique = {}
+    for question in questions:
+        unique.setdefault(normalize_question(question), question)
+
+    sql_by_key, params_by_key, known, to_generate = {}, {}, set(), []
+    for key, question in unique.items():
+        matched = match_intent(question, db_path)
+        if matched is not None:
+            sql_by_key[key], params_by_key[key], _ = matched
+            known.add(key)
+            continue
+        sql_query = get_cached_sql(question, db_path)
+        if sql_query is None:
+            to_generate.append(key)
+        else:
+            sql_by_key[key] = sql_query
+            known.add(key)
+
+    for key, raw_sql in zip(to_generate, ask_gemini_batch([unique[k] for k in to_generate], db_path)):
+        sql_by_key[key] = raw_sql
+
+    def answer(key):
+        question = unique[key]
+        try:
+            sql_query = sql_by_key[key] if key in known \
+                else generate_valid_sql(question, db_path, candidate=sql_by_key[key])
+            _, results = execute_sql(sql_query, db_path, params_by_key.get(key, ()))
+            if key not in known:
+                remember_sql(question, sql_query, db_path)
+            return {"question": question, "sql_query": sql_query,
+                    "results": results if results else [("Notice:", "Query executed but returned no results.")]}
+        except Exception as e:
+            return {"question": question, "error": str(e)}
+
+    # Each task gets a copy of the request context so its spans land in the same trace
+    with ThreadPoolExecutor(max_workers=max(1, min(len(unique), BATCH_WORKERS))) as pool:
+        futures = {key: pool.submit(contextvars.copy_context().run, answer, key) for key in unique}
+        answers = {key: future.result() for key, future in futures.items()}
+
+    return [{**answers[normalize_question(q)], "question": q} for q in questions]
+
+
+# --- Charts ---
+def chart_series(question: str, x: str, y: str, agg: str = None, max_points: int = None,
+                 db_path="database/ecommerce.db", filters: dict = None, answer_token: str = None) -> dict:
+    """
+    Time series for charting the answer to a question: the full result is grouped in
+    SQLite into day, week or month buckets (the smallest that fits max_points) and
+    downsampled with LTTB if still too long, so the UI never receives every row.
+    answer_token (from the /ask answer) charts exactly the SQL, params and filters behind
+    that answer; without it the SQL is generated for the question and filters are applied
+    in SQL first, like in run_query.
+    Raises ValueError for unknown columns or an x column without dates (ISO date text,
+    or epoch days in a visualizer.EPOCH_DAY_COLUMNS column).
+    """
+    max_points = min(max(int(max_points or CHART_MAX_POINTS), 3), CHART_MAX_POINTS)
+    agg = (agg or default_aggregate(y)).lower()
+    if agg not in AGGREGATES:
+        raise ValueError(f"Unsupported aggregate: {agg}")
+
+    if answer_token:
+        sql_query, _, filters, params = decode_page_token(answer_token, db_path)
+        source = "page_token"
+    else:
+        sql_query, params, source = generate_sql(question, db_path)
+    filtered_sql, params, applied = apply_filters(sql_query, filters, db_path, params)
+    with connection(db_path) as conn, query_budget(conn, filtered_sql):
+        # The aggregate covers the whole result, so no LIMIT is injected here
+        with span("sql_guard"):
+            inner = guard_sql(conn, filtered_sql, inject_limit=False, params=params)
+        columns = [col[0] for col in conn.execute(f"SELECT * FROM ({inner}) LIMIT 0", params).description]
+        if x not in columns or y not in columns:
+            raise ValueError(f"Unknown chart column; the result has {', '.join(columns)}")
+
+        day = epoch_day_sql(x)
+        value = '"' + y.replace('"', '""') + '"'
+        days = f"SELECT {day} AS d, {value} AS v FROM ({inner})"
+
+        with span("sqlite_execute"):
+            rows, first_day, last_day = conn.execute(
+                f"SELECT COUNT(*), MIN(d), MAX(d) FROM ({days}) WHERE d IS NOT NULL", params
+            ).fetchone()
+        if not rows:
+            raise ValueError(f"Column {x} has no dates to chart")
+
+        bucket = choose_bucket(first_day, last_day, max_points)
+        bucket_sql = BUCKET_SQL[bucket].format(d="d")
+        measure = "COUNT(v)" if agg == "count" else f"{agg.upper()}(v)"
+        with span("sqlite_execute"):
+            points = conn.execute(
+                f"SELECT {bucket_sql} AS b, {measure} FROM ({days}) "
+                f"WHERE d IS NOT NULL GROUP BY b ORDER BY b", params
+            ).fetchall()
+
+    if source == "gemini":
+        remember_sql(question, sql_query, db_path)
+
+    points = [p for p in points if p[1] is not None]
+    downsampled = len(points) > max_points
+    if downsampled:
+        points = lttb(points, max_points)
+
+    return {"question": question, "sql_query": sql_query, "x": x, "y": y, "agg": agg, "bucket": bucket,
+            "filters": applied, "source_rows": rows, "downsampled": downsampled,
+            "points": [[to_iso(b), v] for b, v in points]}
+
+
+# --- Streaming / Pagination ---
+def encode_page_token(sql_query: str, offset: int, db_path: str, filters: dict = None,
+                      params: tuple = ()) -> str:
+    payload = json.dumps({"sql": sql_query, "params": list(params), "offset": offset, "filters": filters or {},
+                          "v": schema_fingerprint(db_path)})
+    body = base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+    signature = hmac.new(PAGE_TOKEN_SECRET, body.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+    return f"{body}.{signature}"
+
+
+def decode_page_token(token: str, db_path: str) -> tuple[str, int, dict, tuple]:
+    """
+    Returns (sql, offset, filters, params) from a page token. Raises ValueError if the token was tampered
+    with or the data has been reloaded since it was issued.
+    """
+    body, _, signature = token.partition(".")
+    expected = hmac.new(PAGE_TOKEN_SECRET, body.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("Invalid page token")
+    payload = json.loads(base64.urlsafe_b64decode(body.encode("ascii")))
+    if payload["v"] != schema_fingerprint(db_path):
+        raise ValueError("Page token expired because the data was reloaded")
+    return payload["sql"], int(payload["offset"]), payload.get("filters") or {}, tuple(payload.get("params") or ())
+
+
+def _prepare_page(question: str, db_path: str, page_token: str, limit: int, filters: dict) -> dict:
+    # SQL, parameters and offset of one page, from a page token or a new question
+    if page_token:
+        sql_query, offset, filters, params = decode_page_token(page_token, db_path)
+        source = "page_token"
+    else:
+        sql_query, params, source = generate_sql(question, db_path)
+        offset = 0
+    filtered_sql, filtered_params, applied = apply_filters(sql_query, filters, db_path, params)
+    return {"sql_query": sql_query, "source": source, "base_params": params, "filtered_sql": filtered_sql,
+            "params": filtered_params, "filters": applied, "offset": offset,
+            "limit": min(max(int(limit or STREAM_DEFAULT_LIMIT), 1), STREAM_MAX_ROWS),
+            # Identifies the whole answer, so /ask/chart plots the same SQL as the table
+            "answer_token": encode_page_token(sql_query, 0, db_path, applied, params)}
+
+
+def _open_page(conn, question: str, db_path: str, page: dict):
+    # Pages carry their own LIMIT, so the guard only checks the plan here
+    with span("sql_guard"):
+        guarded_sql = guard_sql(conn, page["filtered_sql"], inject_limit=False, params=page["params"])
+    paged_sql = f"SELECT * FROM ({guarded_sql}) LIMIT ? OFFSET ?"
+
+    # Fetch one extra row to know whether another page exists
+    with span("sqlite_execute"):
+        cursor = conn.execute(paged_sql, page["params"] + (page["limit"] + 1, page["offset"]))
+    columns = [col[0] for col in cursor.description or []]
+
+    if page["source"] == "gemini":
+        remember_sql(question, page["sql_query"], db_path)
+    return cursor, columns
+
+
+def fetch_page(question: str = None, db_path="database/ecommerce.db",
+               page_token: str = None, limit: int = None, filters: dict = None) -> dict:
+    """
+    One page of the answer as {"question", "sql_query", "columns", "rows", "filters",
+    "truncated", "next_page_token", "answer_token"}, for the binary /ask formats that encode a whole page
+    at once. Paging, limits and filters work like in stream_query. Raises on errors.
+    """
+    page = _prepare_page(question, db_path, page_token, limit, filters)
+    with connection(db_path) as conn, query_budget(conn, page["filtered_sql"]):
+        cursor, columns = _open_page(conn, question, db_path, page)
+        with span("sqlite_fetch"):
+            rows = cursor.fetchall()
+
+    has_more = len(rows) > page["limit"]
+    rows = rows[:page["limit"]]
+    next_token = encode_page_token(page["sql_query"], page["offset"] + len(rows), db_path, page["filters"],
+                                   page["base_params"]) if has_more else None
+    return {"question": question, "sql_query": page["sql_query"], "columns": columns, "rows": rows,
+            "filters": page["filters"], "truncated": has_more, "next_page_token": next_token,
+            "answer_token": page["answer_token"]}
+
+
+def stream_query(question: str = None, db_path="database/ecommerce.db",
+                 page_token: str = None, limit: int = None, filters: dict = None):
+    """
+    Generator version of run_query that yields NDJSON lines:
+    a header with the SQL, column names and the answer_token for /ask/chart, one JSON array per row,
+    then a trailer with the row count and a next_page_token when more rows exist.
+    Rows are read with fetchmany so memory stays bounded by STREAM_BATCH_SIZE,
+    and a page stops early at STREAM_MAX_ROWS rows or STREAM_MAX_BYTES bytes.
+    filters are applied in SQL (see apply_filters) and carried over in the page token.
+    """
+    try:
+        page = _prepare_page(question, db_path, page_token, limit, filters)
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+        return
+    sql_query, limit, applied = page["sql_query"], page["limit"], page["filters"]
+
+    try:
+        with connection(db_path) as conn, query_budget(conn, page["filtered_sql"], timeout=None):
+            cursor, columns = _open_page(conn, question, db_path, page)
+
+            header = json.dumps({"question": question, "sql_query": sql_query, "columns": columns,
+                                 "filters": applied, "answer_token": page["answer_token"]})
+            yield header + "\n"
+
+            sent, sent_bytes, has_more = 0, len(header) + 1, False
+            while True:
+                with span("sqlite_fetch"):
+                    batch = cursor.fetchmany(STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    if sent >= limit or sent_bytes >= STREAM_MAX_BYTES:
+                        has_more = True
+                        break
+                    line = json.dumps(row, default=str) + "\n"
+                    sent += 1
+                    sent_bytes += len(line)
+                    yield line
+                if has_more:
+                    break
+
+        next_token = encode_page_token(sql_query, page["offset"] + sent, db_path, applied, page["base_params"]) \
+            if has_more else None
+        yield json.dumps({"rows": sent, "bytes": sent_bytes, "truncated": has_more,
+                          "next_page_token": next_token}) + "\n"
+
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
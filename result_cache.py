@@ -0,0 +1,155 @@
+# app/result_cache.py
+
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from app.sql_cache import schema_fingerprint
+
+# In-memory cache of executed SQL results, bounded by an approximate byte budget.
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# A single result may use at most this share of the budget
+MAX_ENTRY_SHARE = 0.25
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_used_bytes = 0
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "too_large": 0}
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<string>'(?:[^']|'')*')
+    | (?P<ident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<number>(?<![\w.])\d+(?:\.\d*)?(?:[eE][+-]?\d+)?(?![\w.]))
+    | (?P<space>\s+)
+    | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL
+)
+
+
+# --- Canonical SQL ---
+def _canonical_number(text: str) -> str:
+    if re.fullmatch(r"\d+", text):
+        return str(int(text))
+    # Keep floats as floats: 5.0 / 2 and 5 / 2 differ in SQLite
+    return repr(float(text))
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Normalizes SQL text for cache lookups: comments and redundant whitespace are removed,
+    keywords and identifiers are lowercased, numeric literals are written in one form.
+    String literals and quoted identifiers are kept verbatim.
+    """
+    out = []
+    pending_space = False
+    for match in _TOKEN_RE.finditer(sql):
+        kind, text = match.lastgroup, match.group()
+        if kind in ("space", "comment"):
+            pending_space = True
+            continue
+        if kind == "number":
+            text = _canonical_number(text)
+        elif kind == "other":
+            text = text.lower()
+        if pending_space and out and (text[0].isalnum() or text[0] in "_'\"`[") \
+                and (out[-1][-1].isalnum() or out[-1][-1] in "_'\"`]"):
+            out.append(" ")
+        pending_space = False
+        out.append(text)
+    return "".join(out).rstrip(";").strip()
+
+
+# --- Columnar storage ---
+def _to_columns(rows: list) -> list:
+    """
+    Stores each column as an array('q') / array('d') when it is uniformly int / float,
+    otherwise as a tuple of Python objects.
+    """
+    columns = []
+    for values in zip(*rows):
+        kinds = {type(v) for v in values}
+        if kinds == {int} and all(-2**63 <= v < 2**63 for v in values):
+            columns.append(array("q", values))
+        elif kinds == {float}:
+            columns.append(array("d", values))
+        else:
+            columns.append(tuple(values))
+    return columns
+
+
+def _column_bytes(column) -> int:
+    if isinstance(column, array):
+        return column.buffer_info()[1] * column.itemsize
+    return sys.getsizeof(column) + sum(sys.getsizeof(v) for v in column)
+
+
+def _from_columns(columns: list) -> list:
+    return list(zip(*columns))
+
+
+# --- Lookup / Store ---
+def _key(sql: str, db_path: str, params: tuple = ()) -> tuple:
+    return (db_path, schema_fingerprint(db_path), canonicalize_sql(sql), tuple(params))
+
+
+def get_cached_result(sql: str, db_path: str, params: tuple = ()):
+    """
+    Returns (column_names, rows) for previously executed SQL (and bound parameters)
+    on the current data version, or None.
+    """
+    key = _key(sql, db_path, params)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        names, columns, _ = entry
+    return names, _from_columns(columns)
+
+
+def store_result(sql: str, db_path: str, names: list, rows: list, params: tuple = ()):
+    """
+    Caches an executed result in columnar form, evicting least recently used entries
+    until the byte budget is respected.
+    """
+    global _used_bytes
+    key = _key(sql, db_path, params)
+    columns = _to_columns(rows)
+    size = sum(_column_bytes(c) for c in columns) + sys.getsizeof(key[2])
+
+    with _lock:
+        if size > RESULT_CACHE_MAX_BYTES * MAX_ENTRY_SHARE:
+            _stats["too_large"] += 1
+            return
+        old = _entries.pop(key, None)
+        if old is not None:
+            _used_bytes -= old[2]
+        _entries[key] = (list(names), columns, size)
+        _used_bytes += size
+        _stats["stores"] += 1
+
+        while _used_bytes > RESULT_CACHE_MAX_BYTES and _entries:
+            _, evicted = _entries.popitem(last=False)
+            _used_bytes -= evicted[2]
+            _stats["evictions"] += 1
+
+
+def clear_result_cache():
+    global _used_bytes
+    with _lock:
+        _entries.clear()
+        _used_bytes = 0
+
+
+def result_cache_stats() -> dict:
+    with _lock:
+        return {**_stats, "entries": len(_entries), "bytes": _used_bytes,
+                "max_bytes": RESULT_CACHE_MAX_BYTES}
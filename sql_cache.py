@@ -0,0 +1,202 @@
+# app/sql_cache.py
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from app.db_pool import connection
+
+# Persistent question → SQL cache so repeated questions skip the Gemini round trip.
+CACHE_DB_PATH = os.getenv("SQL_CACHE_PATH", "database/sql_cache.db")
+CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL_SECONDS = float(os.getenv("SQL_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Trigram similarity threshold for near-duplicate phrasings (0 disables the lookup)
+SIMILARITY_THRESHOLD = float(os.getenv("SQL_CACHE_SIMILARITY", "0"))
+
+_lock = threading.Lock()
+_conn = None
+_fingerprints = {}
+# db_path -> fingerprint whose stale entries were last pruned from the cache
+_pruned = {}
+_stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        folder = os.path.dirname(CACHE_DB_PATH)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        # Entries are per database; caches written before db_path was part of the key are dropped
+        columns = [row[1] for row in _conn.execute("PRAGMA table_info(sql_cache)")]
+        if columns and "db_path" not in columns:
+            _conn.execute("DROP TABLE sql_cache")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS sql_cache (
+                db_path TEXT NOT NULL,
+                key TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (db_path, key)
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_sql_cache_last_used ON sql_cache(last_used)")
+        _conn.commit()
+    return _conn
+
+
+# --- Keys ---
+def normalize_question(question: str) -> str:
+    """
+    Lowercases the question and strips punctuation, emoji and extra whitespace
+    so trivially different phrasings share one cache entry.
+    """
+    text = re.sub(r"[^a-z0-9]+", " ", question.lower())
+    return " ".join(text.split())
+
+
+def schema_fingerprint(db_path: str) -> str:
+    """
+    Hashes the table definitions and PRAGMA user_version of the database.
+    db_loader bumps user_version on every reload, which invalidates old entries.
+    The hash is recomputed only when the database file changes on disk.
+    """
+    try:
+        stamp = os.stat(db_path).st_mtime_ns
+    except OSError:
+        return "missing"
+    if os.path.exists(db_path + "-wal"):
+        stamp = (stamp, os.stat(db_path + "-wal").st_mtime_ns)
+
+    cached = _fingerprints.get(db_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with connection(db_path) as conn:
+        rows = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY type, name"
+        ).fetchall()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    digest = hashlib.sha1(repr((rows, version)).encode("utf-8")).hexdigest()
+    _fingerprints[db_path] = (stamp, digest)
+    return digest
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a: str, b: str) -> float:
+    # Numbers change the meaning ("top 5" vs "top 10"), so they must match exactly
+    if re.findall(r"\d+", a) != re.findall(r"\d+", b):
+        return 0.0
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+
+# --- Lookup / Store ---
+def get_cached_sql(question: str, db_path: str):
+    """
+    Returns the cached SQL for a question against the current schema, or None.
+    Falls back to a trigram similarity search when SQL_CACHE_SIMILARITY is set.
+    """
+    key = normalize_question(question)
+    fingerprint = schema_fingerprint(db_path)
+    db_path = os.path.abspath(db_path)
+    now = time.time()
+
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute(
+            "SELECT key, sql, created_at FROM sql_cache WHERE db_path = ? AND key = ? AND fingerprint = ?",
+            (db_path, key, fingerprint)
+        ).fetchone()
+        similar = False
+
+        if row is None and SIMILARITY_THRESHOLD > 0:
+            best, best_score = None, SIMILARITY_THRESHOLD
+            for candidate in conn.execute(
+                "SELECT key, sql, created_at FROM sql_cache WHERE db_path = ? AND fingerprint = ?",
+                (db_path, fingerprint)
+            ):
+                score = _similarity(key, candidate[0])
+                if score >= best_score:
+                    best, best_score = candidate, score
+            row, similar = best, best is not None
+
+        if row is not None and now - row[2] > CACHE_TTL_SECONDS:
+            conn.execute("DELETE FROM sql_cache WHERE db_path = ? AND key = ?", (db_path, row[0]))
+            conn.commit()
+            _stats["expired"] += 1
+            row = None
+
+        if row is None:
+            _stats["misses"] += 1
+            return None
+
+        conn.execute(
+            "UPDATE sql_cache SET last_used = ?, hits = hits + 1 WHERE db_path = ? AND key = ?",
+            (now, db_path, row[0])
+        )
+        conn.commit()
+        _stats["similar_hits" if similar else "hits"] += 1
+        return row[1]
+
+
+def store_sql(question: str, sql: str, db_path: str):
+    """
+    Caches SQL that executed successfully and evicts expired or least recently used entries.
+    Entries of an older schema are pruned once per schema change, and only for this database,
+    so databases sharing the cache file (e.g. benchmark and production) keep their entries.
+    """
+    key = normalize_question(question)
+    fingerprint = schema_fingerprint(db_path)
+    db_path = os.path.abspath(db_path)
+    now = time.time()
+
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sql_cache (db_path, key, fingerprint, question, sql, created_at, last_used, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (db_path, key, fingerprint, question, sql, now, now)
+        )
+        if _pruned.get(db_path) != fingerprint:
+            conn.execute("DELETE FROM sql_cache WHERE db_path = ? AND fingerprint != ?", (db_path, fingerprint))
+            _pruned[db_path] = fingerprint
+        conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (now - CACHE_TTL_SECONDS,))
+        evicted = conn.execute(
+            "DELETE FROM sql_cache WHERE rowid IN ("
+            "  SELECT rowid FROM sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?"
+            ")",
+            (CACHE_MAX_ENTRIES,)
+        ).rowcount
+        conn.commit()
+        _stats["stores"] += 1
+        _stats["evictions"] += max(evicted, 0)
+
+
+def clear_sql_cache():
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM sql_cache")
+        conn.commit()
+        _fingerprints.clear()
+        _pruned.clear()
+
+
+def cache_stats() -> dict:
+    with _lock:
+        size = _get_conn().execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        return {**_stats, "entries": size}
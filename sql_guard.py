@@ -0,0 +1,175 @@
+# app/sql_guard.py
+
+import os
+import re
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+
+# Pre-execution checks for model-generated SQL, plus a per-query time and VM-step budget.
+GUARD_DEFAULT_LIMIT = int(os.getenv("GUARD_DEFAULT_LIMIT", "10000"))
+GUARD_MAX_JOIN_ROWS = int(os.getenv("GUARD_MAX_JOIN_ROWS", "1000000"))
+GUARD_MAX_SCAN_ROWS = int(os.getenv("GUARD_MAX_SCAN_ROWS", "50000000"))
+GUARD_WARN_SCAN_ROWS = int(os.getenv("GUARD_WARN_SCAN_ROWS", "100000"))
+GUARD_TIMEOUT_SECONDS = float(os.getenv("GUARD_TIMEOUT_SECONDS", "10"))
+GUARD_MAX_VM_STEPS = int(os.getenv("GUARD_MAX_VM_STEPS", "200000000"))
+REJECTED_LOG_PATH = os.getenv("GUARD_REJECTED_LOG", "database/rejected_queries.jsonl")
+
+# The progress handler runs every this many VM instructions
+PROGRESS_INTERVAL = 10000
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_TABLE_ALIAS_RE = re.compile(
+    r"(?:\bfrom|\bjoin|,)\s+(\w+)(?:\s+(?:as\s+)?(?!(?:on|using|where|join|inner|left|right|cross|"
+    r"natural|full|outer|group|order|limit|having|union|window)\b)(\w+))?",
+    re.IGNORECASE
+)
+_PLAN_LOOP_RE = re.compile(r"^(SCAN|SEARCH) (\w+)")
+
+
+class QueryRejected(ValueError):
+    def __init__(self, reason: str, sql: str = ""):
+        super().__init__(f"Query rejected: {reason}")
+        self.reason = reason
+        self.sql = sql
+
+
+def _masked(sql: str) -> str:
+    # Blank out comments and literals so keywords inside them are ignored
+    sql = _COMMENT_RE.sub(" ", sql)
+    return _STRING_RE.sub(lambda m: "'" + "_" * (len(m.group()) - 2) + "'", sql)
+
+
+def _top_level(sql: str) -> str:
+    # Drop everything nested in parentheses (subqueries, function arguments)
+    out, depth = [], 0
+    for ch in sql:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0:
+            out.append(ch)
+    return "".join(out)
+
+
+def _table_rows(conn: sqlite3.Connection, table: str) -> int:
+    """
+    Row estimate from sqlite_stat1 (written by ANALYZE in db_loader), falling back to COUNT(*).
+    """
+    try:
+        row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)).fetchone()
+        if row:
+            return int(row[0].split()[0])
+    except sqlite3.Error:
+        pass
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def log_rejection(sql: str, reason: str):
+    folder = os.path.dirname(REJECTED_LOG_PATH)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(REJECTED_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"ts": time.time(), "reason": reason, "sql": sql}) + "\n")
+
+
+def reject(sql: str, reason: str):
+    print(f"⛔ Rejected SQL ({reason}):\n{sql}\n")
+    log_rejection(sql, reason)
+    raise QueryRejected(reason, sql)
+
+
+def guard_sql(conn: sqlite3.Connection, sql: str, inject_limit: bool = True, params: tuple = ()) -> str:
+    """
+    Checks SQL before it runs and returns the (possibly rewritten) statement.
+    Rejects multiple statements, non-SELECT statements and nested-loop joins whose inner
+    loop is a full scan (cartesian products) above GUARD_MAX_JOIN_ROWS row pairs.
+    Appends LIMIT GUARD_DEFAULT_LIMIT when the statement has no top-level LIMIT.
+    params are the values bound to the statement's placeholders, if any.
+    Raises QueryRejected with the reason, which is also appended to the rejected query log.
+    """
+    sql = sql.strip().rstrip(";").strip()
+    masked = _masked(sql)
+
+    if ";" in masked:
+        reject(sql, "multiple statements")
+    if not re.match(r"\s*(select|with)\b", masked, re.IGNORECASE):
+        reject(sql, "only SELECT statements are allowed")
+
+    # EXPLAIN QUERY PLAN also catches syntax errors before any work is done
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_RE.findall(masked):
+        aliases[table.lower()] = table
+        if alias:
+            aliases[alias.lower()] = table
+
+    loops_by_parent = {}
+    for _, parent, _, detail in plan:
+        match = _PLAN_LOOP_RE.match(detail)
+        if match:
+            loops_by_parent.setdefault(parent, []).append((match.group(1), match.group(2), detail))
+
+    for loops in loops_by_parent.values():
+        scans = []
+        for kind, name, detail in loops:
+            if kind != "SCAN" or name.startswith("("):
+                continue
+            table = aliases.get(name.lower(), name)
+            rows = _table_rows(conn, table)
+            scans.append((table, rows))
+            if rows > GUARD_MAX_SCAN_ROWS:
+                reject(sql, f"full scan of {table} (~{rows} rows)")
+            if rows > GUARD_WARN_SCAN_ROWS and "INDEX" not in detail:
+                print(f"ℹ Full table scan of {table} (~{rows} rows)")
+
+        # Sibling loops run nested, so several full scans multiply
+        if len(scans) > 1:
+            pairs = 1
+            for _, rows in scans:
+                pairs *= max(rows, 1)
+            if pairs > GUARD_MAX_JOIN_ROWS:
+                names = " × ".join(table for table, _ in scans)
+                reject(sql, f"cartesian join without a usable join key: {names} (~{pairs} row pairs)")
+
+    if inject_limit and not re.search(r"\blimit\b", _top_level(masked), re.IGNORECASE):
+        sql = f"{sql}\nLIMIT {GUARD_DEFAULT_LIMIT}"
+
+    return sql
+
+
+@contextmanager
+def query_budget(conn: sqlite3.Connection, sql: str = "", timeout: float = GUARD_TIMEOUT_SECONDS,
+                 max_steps: int = GUARD_MAX_VM_STEPS):
+    """
+    Aborts the statement running on conn once it exceeds the wall-clock timeout or
+    VM-step budget. Covers both execute() and the fetches inside the with-block.
+    Pass timeout=None to enforce only the step budget (e.g. while streaming to a slow client).
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+    state = {"steps": 0, "reason": None}
+
+    def handler():
+        state["steps"] += PROGRESS_INTERVAL
+        if state["steps"] > max_steps:
+            state["reason"] = f"exceeded the budget of {max_steps} VM steps"
+        elif time.monotonic() > deadline:
+            state["reason"] = f"exceeded the {timeout:g}s time budget"
+        return 1 if state["reason"] else 0
+
+    conn.set_progress_handler(handler, PROGRESS_INTERVAL)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if state["reason"] and "interrupt" in str(e):
+            log_rejection(sql, state["reason"])
+            raise QueryRejected(state["reason"], sql) from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
@@ -0,0 +1,111 @@
+# app/sql_repair.py
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from app.db_pool import connection
+from app.sql_cache import schema_fingerprint, normalize_question
+from app.result_cache import canonicalize_sql
+from app.sql_guard import guard_sql, QueryRejected
+from app.metrics import span, annotate
+
+# Validation and repair of generated SQL: candidates are compiled with EXPLAIN QUERY PLAN
+# (through the guard) on a read-only connection, and failures go back to the model with
+# the SQLite error for at most SQL_REPAIR_MAX_ATTEMPTS repairs.
+REPAIR_MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+REPAIR_MEMO_SIZE = int(os.getenv("SQL_REPAIR_MEMO_SIZE", "1000"))
+
+_lock = threading.Lock()
+# (fingerprint, canonical sql) -> error, so known-bad SQL is never run again
+_bad_sql = OrderedDict()
+# (fingerprint, normalized question) -> [(sql, error)], so a retried question starts with its past mistakes
+_failures = OrderedDict()
+_stats = {"generated": 0, "valid_first_try": 0, "repaired": 0, "failed": 0,
+          "repair_calls": 0, "validations": 0, "memo_hits": 0, "retries_with_history": 0}
+
+
+def _remember(memo: OrderedDict, key, value):
+    memo[key] = value
+    memo.move_to_end(key)
+    while len(memo) > REPAIR_MEMO_SIZE:
+        memo.popitem(last=False)
+
+
+def validate_sql(sql_query: str, db_path: str):
+    """
+    Returns None when the SQL compiles and passes the guard, otherwise the error message.
+    SQL already known to fail against the current schema is answered from memory.
+    """
+    key = (schema_fingerprint(db_path), canonicalize_sql(sql_query))
+    with _lock:
+        error = _bad_sql.get(key)
+        if error is not None:
+            _stats["memo_hits"] += 1
+            return error
+        _stats["validations"] += 1
+
+    try:
+        with span("sql_validate"), connection(db_path) as conn:
+            guard_sql(conn, sql_query, inject_limit=False)
+        return None
+    except QueryRejected as e:
+        error = str(e)
+    except sqlite3.Error as e:
+        error = f"{type(e).__name__}: {e}"
+
+    with _lock:
+        _remember(_bad_sql, key, error)
+    return error
+
+
+def past_failures(question: str, db_path: str) -> list:
+    key = (schema_fingerprint(db_path), normalize_question(question))
+    with _lock:
+        failures = list(_failures.get(key, []))
+        if failures:
+            _stats["retries_with_history"] += 1
+    return failures
+
+
+def record_failure(question: str, sql_query: str, error: str, db_path: str) -> list:
+    """
+    Adds a failed (sql, error) pair to the question's history and returns the history.
+    """
+    key = (schema_fingerprint(db_path), normalize_question(question))
+    canonical = canonicalize_sql(sql_query)
+    with _lock:
+        failures = [f for f in _failures.get(key, []) if canonicalize_sql(f[0]) != canonical]
+        failures.append((sql_query, error))
+        _remember(_failures, key, failures[-(REPAIR_MAX_ATTEMPTS + 1):])
+        return list(_failures[key])
+
+
+def forget_failures(question: str, db_path: str):
+    with _lock:
+        _failures.pop((schema_fingerprint(db_path), normalize_question(question)), None)
+
+
+def record_outcome(repairs: int, ok: bool):
+    """
+    Counts one generation: valid on the first try, repaired after `repairs` calls, or failed.
+    """
+    with _lock:
+        _stats["generated"] += 1
+        _stats["repair_calls"] += repairs
+        if not ok:
+            _stats["failed"] += 1
+        elif repairs:
+            _stats["repaired"] += 1
+        else:
+            _stats["valid_first_try"] += 1
+    annotate(repairs=repairs, sql_valid=ok)
+
+
+def repair_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["bad_sql_entries"] = len(_bad_sql)
+    stats["success_rate"] = round((stats["valid_first_try"] + stats["repaired"]) / stats["generated"], 4) \
+        if stats["generated"] else 0.0
+    return stats
@@ -0,0 +1,78 @@
+# app/startup_report.py
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Cold-start report for the backend entry points, based on `python -X importtime`.
+# Run from the directory containing the app package: python -m app.startup_report
+ENTRY_POINTS = ["app.main", "app.asgi"]
+
+# Dependencies that must stay out of the import path and load on first use instead
+LAZY_MODULES = ["google.generativeai", "pandas", "plotly", "sqlalchemy", "duckdb", "pyarrow", "msgpack", "zstandard"]
+
+
+def measure(module: str) -> dict:
+    """
+    Imports `module` in a fresh interpreter and returns the wall time, the -X importtime
+    entries ({name: (self_us, cumulative_us)}) and any LAZY_MODULES that were loaded eagerly.
+    """
+    env = {**os.environ, "WARM_UP_ON_START": "0", "PYTHONDONTWRITEBYTECODE": "1"}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports[name.strip()] = (int(self_us), int(cumulative_us))
+
+    eager = sorted(m for m in LAZY_MODULES if m in imports)
+    return {"module": module, "seconds": round(seconds, 3), "imports": imports, "eager": eager}
+
+
+def report(result: dict, top: int) -> dict:
+    slowest = sorted(result["imports"].items(), key=lambda item: item[1][1], reverse=True)[:top]
+    own = result["imports"].get(result["module"], (0, 0))[1]
+    print(f"\n{result['module']}: {own / 1000:.0f} ms of imports, {result['seconds'] * 1000:.0f} ms process start")
+    for name, (_, cumulative) in slowest:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+    if result["eager"]:
+        print(f"  ❌ Imported at startup: {', '.join(result['eager'])}")
+    return {"module": result["module"], "import_ms": round(own / 1000, 1), "process_ms": round(result["seconds"] * 1000, 1),
+            "eager": result["eager"], "slowest": [{"name": n, "cumulative_ms": round(c / 1000, 1)} for n, (_, c) in slowest]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time report for the backend entry points")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail when an import takes longer")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    ok, results = True, []
+    for module in args.modules:
+        summary = report(measure(module), args.top)
+        results.append(summary)
+        if summary["eager"] or (args.budget_ms is not None and summary["import_ms"] > args.budget_ms):
+            ok = False
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    print("\n✅ Startup budget met" if ok else "\n❌ Startup budget exceeded")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,171 @@
+# user_store.py
+
 import os
+import hmac
 import json
+import time
+import base64
+import hashlib
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from db_pool import connection
+
+# --- Settings ---
+USER_DB_PATH = os.getenv("USER_DB_PATH", "users.db")
+USER_DATA_FILE = "users.json"  # legacy plaintext store, migrated once into USER_DB_PATH
+
+# scrypt cost: N=2**14, r=8 needs 16 MB per hash and takes ~50 ms
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Hashing runs on this many worker threads, which also caps the memory used by concurrent logins
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", str(12 * 3600)))
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+
+# --- Password Hashing ---
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r, dklen=32)
+
+def hash_password(password: str) -> str:
+    """
+    Salted scrypt hash, stored as scrypt$n$r$p$salt$hash (base64).
+    """
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return "$".join(["scrypt", str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+def verify_password(password: str, stored: str) -> bool:
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, digest = stored.split("$")
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(actual, base64.b64decode(digest))
+    if stored.startswith("$2"):
+        # bcrypt hashes from the old users.db; rehashed with scrypt on the next successful login
+        try:
+            import bcrypt
+        except ImportError:
+            print("⚠ bcrypt is not installed; legacy password hashes can't be verified")
+            return False
+        return bcrypt.checkpw(password.encode("utf-8"), stored.encode("utf-8"))
+    return False
 
-USER_DATA_FILE = "users.json"
+def _needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
 
-# Create file if it doesn't exist
-if not os.path.exists(USER_DATA_FILE):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump({}, f)
+# --- Store ---
+def init_store(db_path: str = USER_DB_PATH, json_path: str = USER_DATA_FILE):
+    with connection(db_path, readonly=False) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+    migrate_json_users(json_path, db_path)
 
-def load_users():
-    with open(USER_DATA_FILE, "r") as f:
-        return json.load(f)
+def migrate_json_users(json_path: str = USER_DATA_FILE, db_path: str = USER_DB_PATH) -> int:
+    """
+    One-shot import of the plaintext users.json into the SQLite store. users.json is what
+    the app logged in against, so its passwords win over rows already in the table. They are
+    hashed on the way in and the plaintext file is deleted once the import has committed.
+    Returns the number of users imported.
+    """
+    # Plaintext copies left behind by earlier versions of this migration
+    if os.path.exists(json_path + ".migrated"):
+        os.remove(json_path + ".migrated")
+    if not os.path.exists(json_path):
+        return 0
+    with open(json_path, "r") as f:
+        users = json.load(f)
 
-def save_users(users):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(users, f, indent=2)
+    names = list(users)
+    hashes = list(_hash_pool.map(hash_password, [str(users[name]) for name in names]))
+    with connection(db_path, readonly=False) as conn:
+        conn.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?) "
+                         "ON CONFLICT(username) DO UPDATE SET password_hash = excluded.password_hash",
+                         zip(names, hashes))
+        conn.commit()
 
-def add_user(username, password):
-    users = load_users()
-    if username in users:
-        return False  # already exists
-    users[username] = password
-    save_users(users)
+    os.remove(json_path)
+    print(f"✅ Migrated {len(names)} users from {json_path} to {db_path} and deleted the plaintext file")
+    return len(names)
+
+def _stored_hash(username: str, db_path: str = USER_DB_PATH):
+    with connection(db_path, readonly=False) as conn:
+        row = conn.execute("SELECT password_hash FROM users WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        return None
+    # Legacy bcrypt hashes were stored as bytes
+    return row[0].decode("utf-8") if isinstance(row[0], bytes) else row[0]
+
+def add_user(username, password, db_path: str = USER_DB_PATH):
+    if not username or not password:
+        return False
+    password_hash = _hash_pool.submit(hash_password, password).result()
+    with connection(db_path, readonly=False) as conn:
+        try:
+            conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
+            conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False  # already exists
+
+def validate_user(username, password, db_path: str = USER_DB_PATH):
+    stored = _stored_hash(username, db_path)
+    if stored is None:
+        # Hash anyway so unknown usernames take as long as wrong passwords
+        _hash_pool.submit(hash_password, password or "").result()
+        return False
+    if not _hash_pool.submit(verify_password, password or "", stored).result():
+        return False
+
+    if _needs_rehash(stored):
+        new_hash = _hash_pool.submit(hash_password, password).result()
+        with connection(db_path, readonly=False) as conn:
+            conn.execute("UPDATE users SET password_hash = ? WHERE username = ?", (new_hash, username))
+            conn.commit()
     return True
 
-def validate_user(username, password):
-    users = load_users()
-    return users.get(username) == password
+# --- Sessions ---
+# Token -> (username, expiry). Streamlit reruns check the token instead of re-hashing the password.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def create_session(username: str) -> str:
+    token = secrets.token_urlsafe(32)
+    now = time.monotonic()
+    with _sessions_lock:
+        for t in [t for t, (_, expires) in _sessions.items() if expires < now]:
+            del _sessions[t]
+        _sessions[token] = (username, now + SESSION_TTL)
+    return token
+
+def session_user(token):
+    """
+    Username for a live session token, or None when it is unknown or expired.
+    """
+    if not token:
+        return None
+    with _sessions_lock:
+        entry = _sessions.get(token)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del _sessions[token]
+            return None
+        return entry[0]
+
+def end_session(token):
+    with _sessions_lock:
+        _sessions.pop(token, None)
+
+init_store()
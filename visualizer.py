@@ -1,8 +1,92 @@
 # utils/visualizer.py
-import plotly.express as px
-import pandas as pd
+from datetime import date, timedelta
+
+# --- Time-series shaping for charts ---
+# Points are (epoch_day, value) pairs; dates are days since 1970-01-01 like in the database.
+EPOCH = date(1970, 1, 1)
+BUCKETS = {"day": 1, "week": 7, "month": 30}
+AVERAGED_SUFFIXES = ("ctr", "cpc", "roas", "rate", "ratio", "pct", "percent", "avg", "average")
+AGGREGATES = ("sum", "avg", "min", "max", "count")
+
+# Integer columns holding days since 1970-01-01 (see db_loader); other integers, like item_id, are not dates
+EPOCH_DAY_COLUMNS = ("date", "eligibility_datetime_utc")
+
+# SQL that turns ISO date/datetime text, or an integer day in an EPOCH_DAY_COLUMNS column,
+# into an integer epoch day; anything else becomes NULL
+TEXT_DAY_SQL = ("WHEN typeof({x}) = 'text' AND {x} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' "
+                "THEN CAST(julianday({x}) - 2440587.5 AS INTEGER)")
+EPOCH_DAY_SQL = "CASE WHEN typeof({x}) = 'integer' THEN {x} " + TEXT_DAY_SQL + " END"
+
+
+def epoch_day_sql(column: str) -> str:
+    x = '"' + column.replace('"', '""') + '"'
+    template = EPOCH_DAY_SQL if column.lower() in EPOCH_DAY_COLUMNS else "CASE " + TEXT_DAY_SQL + " END"
+    return template.format(x=x)
+
+# Bucket start for an epoch-day expression; 1970-01-01 was a Thursday, so weeks start on Monday
+BUCKET_SQL = {
+    "day": "{d}",
+    "week": "{d} - (({d} + 3) % 7)",
+    "month": "CAST(julianday(date({d} * 86400, 'unixepoch', 'start of month')) - 2440587.5 AS INTEGER)",
+}
+
+
+def default_aggregate(column: str) -> str:
+    # Ratios are averaged per bucket, everything else is summed
+    return "avg" if column.lower().endswith(AVERAGED_SUFFIXES) else "sum"
+
+
+def choose_bucket(first_day: int, last_day: int, max_points: int) -> str:
+    """
+    Smallest bucket (day, week, month) that keeps the number of buckets within max_points.
+    """
+    span = last_day - first_day + 1
+    for name, days in BUCKETS.items():
+        if span / days <= max_points:
+            return name
+    return "month"
+
+
+def lttb(points: list, threshold: int) -> list:
+    """
+    Largest-Triangle-Three-Buckets downsampling of x-sorted (x, y) points to `threshold`
+    points, keeping the first and last point and the visually significant peaks in between.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        start, end = int((i + 1) * every) + 1, min(int((i + 2) * every) + 1, n)
+        next_bucket = points[start:end] or [points[-1]]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def to_iso(day: int) -> str:
+    return (EPOCH + timedelta(days=int(day))).isoformat()
+
+
+def generate_chart(df):
+    import plotly.express as px
 
-def generate_chart(df: pd.DataFrame):
     if "date" in df.columns and "total_sales" in df.columns:
         fig = px.line(df, x="date", y="total_sales", title="Sales Over Time")
     elif "item_id" in df.columns and "total_units_ordered" in df.columns: